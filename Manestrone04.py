@@ -18,99 +18,47 @@
 #  slider bars implemented.
 #  "Apogeeinfo" renamed to "HWdata", as the former is a bit too long.
 #  bug fixes.
+#  device is polled once per update tick, and the result is shared by every view.
+#  register values are kept in a shadow register file (HWregs).
+#  device access and mixer calculation moved to ManestroneCore.py (no wx needed).
+#  polling thread moved to ManestroneCore.py (pollThread), shared with ManestroneDaemon.py.
+#  OFFLINE uses the simulated device (ManestroneSim.py), instead of echoing the widgets.
+#  USB errors do not stop polling, and GUI waits for the device ManestroneCore.callBudget at most.
+#  mixer message is kept per mixer in ManestroneCore (push_mixer), not per view.
 
-import usb.core
-import usb.util
 import wx
+import time
 import threading
-import math
+import ManestroneCore as core
+import ManestroneSim
+from ManestroneCore import ApogeeDevices, get_dev_value, set_dev_value
 
 programName = "Manestrone"
-OFFLINE = False        # just for GUI visual checking (no apogee device needed)
+OFFLINE = False        # if True, ManestroneSim is used instead of apogee device
 disable_mixer = False # as most elements cannot be controlled...
 borderValue = 10
 inputWindowSize = (1140,420)
 mixerWindowSize = (1140,420)
 mainWindowSize = (1140,420)
 outputWindowSize = (1140,420)
-updateInterval = 0.1 # interval for periodic information update of the device
-
-#
-# global variable
-#
-# vendor ID, product ID, product name, number of input, output.
-
-Quartet = {}                           # dict of device(Quartet) info 
-Quartet["VendorID"] = 0x0c60
-Quartet["ProductID"] = 0x0014
-Quartet["ProductName"] = "Apogee Quartet"
-
-Quartet["InputNum"] = 4
-Quartet["softLimit_Request"]  = 17
-Quartet["phase_Request"]      = 19
-Quartet["phantom_Request"]    = 21
-Quartet["inputType_Request"]  = 22
-Quartet["micLevel_Request"]   = 52
-Quartet["instLevel_Request"]  = 62
-Quartet["inputGroup_Request"] = 68
-Quartet["inputType"]        = ["Line  +4dB", "Line -10dB", "Microphone", "Instrument"]
-Quartet["micLevel_Range"]   = {"Min":0, "Max":75}
-Quartet["instLevel_Range"]  = {"Min":0, "Max":65}
-Quartet["inputGroupChoice"] = ["Group OFF", "Group 1", "Group2 "]
-
-Quartet["outputLevel_Request"]     =  51
-Quartet["outputMute_Request"]      =  53
-Quartet["outputDim_Request"]       =  64
-Quartet["outputConfig_Request"]    =  69
-Quartet["outputMono_Request"]      =  70
-Quartet["output_Line_Request"]     =  71
-Quartet["outputSource_Request"]    =  83
-Quartet["outputLineLevel_Request"] = 182
-Quartet["output_Speaker_Index"]   = 0
-Quartet["output_Headphone_Index"] = 1
-Quartet["outputConfigChoice"]    = ["Line", "Stereo", "2 Speaker Sets", "3 Speaker Sets", "5.1"]
-Quartet["output_LineNameChoice"] = ["Line 1/2", "Line 3/4", "Line 5/6"] 
-Quartet["line_Name"]             = ["Line 1/2", "Headphone", "Line 5/6", "Line 3/4"]
-Quartet["output_Line_Index"]     = [0, 3, 2]
-Quartet["output_SpSelectIndex"]  = [1, 2, 4]
-Quartet["output_SpChoiceToIndex"] = {0:0, 1:0, 2:1, 4:2} # key 0 is for offline use.
-Quartet["outputSource_Dest"]     = [0 ,3, 2, 1] # line1/2:index0, headphone:index3,
-                                                # line 5/6:index2, line3/4:index1
-Quartet["outputSourceChoice"]    = ["Output 1/2",
-                                    "Output 3/4",
-                                    "Output 5/6",
-                                    "Output 7/8",
-                                    "Mixer    1",
-                                    "Mixer    2"] 
-Quartet["outputLineLevelChoice"] = ["+ 4dBV", "-10dBV"]
-Quartet["outputLevel_Range"]     = {"Min":-64, "Max":0}
-
-Quartet["mixer_Num"]           =  2 # wValue = 0, 1
-Quartet["mixerChannel_Num"]    = 12 # number of input channels. actually quartet has 12(index 0-11,
-                                  # (4 analog, 8 digital)
-Quartet["mixerChannel_SWR"]    = 12 # software return channel
-Quartet["mixerChannel_Master"] = 13  # master output channel
-Quartet["mixerHWset_Request"]   = 16
-Quartet["mixerSoftRtn_Request"] = 54 # software return source
-Quartet["mixerLevel_Request"]   = 76
-Quartet["mixerPan_Request"]     = 77
-Quartet["mixerSolo_Request"]    = 78
-Quartet["mixerMute_Request"]    = 79
-Quartet["mixerSoftRtnChoice"] = ["Playback 1/2", "Playback 3/4",  "Playback 5/6",  "Playback 7/8"]
-Quartet["mixerLevel_Range"]   = {"Min":-48, "Max":6}
-Quartet["mixerPan_Range"]     = {"Min":-64, "Max":64}
-
-ApogeeDevices = [Quartet]     # list of supported devices (currently only Quartet)
-
-dev = None                    # hardware device found
-HWdata = None             # dict of info for identified device
-
-def get_dev_value(request, wValue = 0, wIndex = 0):
-    return dev.ctrl_transfer(0xc0, HWdata[request], wValue, wIndex, 1)[0]
-
-def set_dev_value(request, wValue = 0, wIndex =0, msg = None):
-    if OFFLINE == False:
-        dev.ctrl_transfer(0x40, HWdata[request], wValue, wIndex,  [msg])
+updateInterval = 0.1 # first interval for periodic information update of the device.
+                     # each register is polled at period of its tier (see ManestroneCore.pollPeriod)
+
+HWdata = None             # dict of info for identified device (same as ManestroneCore.HWdata)
+
+def need_update(panel, changed): # False if the panel can skip update for "changed" registers
+                                 # (None: update anyway). hidden panel is marked stale and
+                                 # caught up when shown (see mainWindow.show_changed).
+    if changed is None:
+        panel.stale = False
+        return True
+    if panel.regs.isdisjoint(changed):
+        return False
+    if not panel.IsShownOnScreen():
+        panel.stale = True
+        return False
+    panel.stale = False
+    return True
 
 class stripPanel(wx.Panel):
 
@@ -197,25 +145,35 @@ class stripPanel(wx.Panel):
             self.Solo.Disable()
             self.Mute.Disable()
 
+        self.regs = set() # registers shown in this panel (see update)
+        self.stale = False
+        self.regs.add(("mixerLevel_Request", mixerindex, channel))
+        if (self.index == HWdata["mixerChannel_SWR"]):
+            self.regs.add(("mixerSoftRtn_Request", 0, mixerindex))
+        if (self.index < HWdata["mixerChannel_Num"]):
+            self.regs.add(("mixerPan_Request", mixerindex, channel))
+        if (self.index != HWdata["mixerChannel_Master"]):
+            self.regs.add(("mixerSolo_Request", mixerindex, channel))
+            self.regs.add(("mixerMute_Request", mixerindex, channel))
+
         self.update()
 
     def get_mixer_info(self): # this function gathers mixer setting stored in hardware.
                               # for "info", see "ApogeeDevices".
 
-        if OFFLINE == False:
-            self.level = get_dev_value("mixerLevel_Request", self.mixerindex,
-                                       self.index) + HWdata["mixerLevel_Range"]["Min"]  #  - 48
+        self.level = get_dev_value("mixerLevel_Request", self.mixerindex,
+                                   self.index) + HWdata["mixerLevel_Range"]["Min"]  #  - 48
 
-            if (self.index == HWdata["mixerChannel_SWR"]):
-                self.source = get_dev_value("mixerSoftRtn_Request", 0, self.mixerindex)
+        if (self.index == HWdata["mixerChannel_SWR"]):
+            self.source = get_dev_value("mixerSoftRtn_Request", 0, self.mixerindex)
 
-            if (self.index < HWdata["mixerChannel_Num"]):
-                self.pan = get_dev_value("mixerPan_Request", self.mixerindex,
-                                         self.index) + HWdata["mixerPan_Range"]["Min"] #  - 64
+        if (self.index < HWdata["mixerChannel_Num"]):
+            self.pan = get_dev_value("mixerPan_Request", self.mixerindex,
+                                     self.index) + HWdata["mixerPan_Range"]["Min"] #  - 64
 
-            if (self.index != HWdata["mixerChannel_Master"]):
-                self.solo = get_dev_value("mixerSolo_Request", self.mixerindex, self.index)
-                self.mute = get_dev_value("mixerMute_Request", self.mixerindex, self.index)
+        if (self.index != HWdata["mixerChannel_Master"]):
+            self.solo = get_dev_value("mixerSolo_Request", self.mixerindex, self.index)
+            self.mute = get_dev_value("mixerMute_Request", self.mixerindex, self.index)
 
         if (self.index == HWdata["mixerChannel_SWR"]):
             self.Pan.Hide()
@@ -230,7 +188,11 @@ class stripPanel(wx.Panel):
 
         self.Layout()
 
-    def update(self):   # this function update display of software, but does not affect hardware.
+    def update(self, changed = None): # this function update display of software,
+                                      # but does not affect hardware.
+                                      # "changed" is list of changed registers (None: update anyway)
+        if not need_update(self, changed):
+            return
         self.get_mixer_info()
         self.Source.SetSelection(self.source)
         self.Level.SetValue(self.level)
@@ -254,48 +216,40 @@ class stripPanel(wx.Panel):
         # in case of mixer, set_dev_value change setting info stored in the hardware,
         # but does not affect hardware behavior.
         # so following is needed.
-        self.parent.setmixer()
+        self.parent.setmixer(self.index)
 
     def on_mixer_levelslider_changed(self, event):
         self.level = self.LevelSlider.GetValue()
         set_dev_value("mixerLevel_Request", self.mixerindex, self.index,
                           self.level - HWdata["mixerLevel_Range"]["Min"]) # + 48
         self.Level.SetValue(self.level)
-        self.parent.setmixer()
+        self.parent.setmixer(self.index)
 
     def on_mixer_pan_changed(self, event):
         self.pan = self.Pan.GetValue()
         set_dev_value("mixerPan_Request", self.mixerindex, self.index,
                       self.pan  - HWdata["mixerPan_Range"]["Min"]) # + 64
         self.PanSlider.SetValue(self.pan)
-        self.parent.setmixer()
+        self.parent.setmixer(self.index)
 
     def on_mixer_panslider_changed(self, event):
         self.pan = self.PanSlider.GetValue()
         set_dev_value("mixerPan_Request", self.mixerindex, self.index,
                       self.pan  - HWdata["mixerPan_Range"]["Min"]) # + 64
         self.Pan.SetValue(self.pan)
-        self.parent.setmixer()
+        self.parent.setmixer(self.index)
                       
     def on_solo_toggled(self, event):
         self.solo = event.GetInt()
         set_dev_value("mixerSolo_Request", self.mixerindex, self.index, self.solo)
-        self.parent.setmixer()
+        self.parent.setmixer() # solo affects every channel
 
     def on_mute_toggled(self, event):
         self.mute = event.GetInt()
         set_dev_value("mixerMute_Request", self.mixerindex, self.index, self.mute)
-        self.parent.setmixer()
-
-    def sp_info(self):
-        self.get_mixer_info()
-        if self.index == HWdata["mixerChannel_SWR"]: # software return source
-            return {"Level":self.level, "Pan":None, "Mute":self.mute, "Solo":self.solo}
-        else:
-            return {"Level":self.level, "Pan":self.pan, "Mute":self.mute, "Solo":self.solo}
+        self.parent.setmixer(self.index)
 
     def master_level(self):
-        self.get_mixer_info()
         return self.level
 
 
@@ -307,23 +261,6 @@ class mixerPanel(wx.Panel):
         self.parent = parent
         self.index = index
         self.spList = {} # list of input strip panels
-        self.spInfo = {} # info of input & software return strip settings. each element is:
-                         # {"Level":(-48 - +6),
-                         #  "Pan":(-64 - + 64, None for SWR),
-                         #  "Mute":(bool)
-                         #  "Solo":(bool)}
-        self.outLevel = None # info of mixer master output setting. (-48 - +6)
-        self.mixerHWinfo = {} # each element corresponds to each input/swr.
-                              # each element is, basically:
-                              # {"mute":(bool) if true, below values are ignored.
-                              # "left" :(int) = int(8192(=0x2000) * exp(10^0.05, input dB+master dB)
-                              #                 * cos(mixerPan(=0-128)/128 * PI()/2))
-                              # "right":(int) = int(8192(=0x2000) * log10(input dB + master dB)
-                              #                 * sin(mixerPan(=0-128)/128 * PI()/2))
-        self.step = math.pow(10,(1/200)) # 1.01157945 # 
-        self.db =   math.pow(10,(1/20))  # 1.1220185   # 
-        self.panRange = HWdata["mixerPan_Range"]["Max"] - HWdata["mixerPan_Range"]["Min"]
-        #               +64 - -64 = 128
 
         hbox = wx.BoxSizer(wx.HORIZONTAL)
         self.SetSizer(hbox)
@@ -357,95 +294,19 @@ class mixerPanel(wx.Panel):
                 self.spList[i].Show(False)
         self.Layout()
 
-    def update(self):
+    def update(self, changed = None):
         for each in self.spList.values():
-            each.update()
-        self.masterPanel.update()
-
-    def setmixer(self):
-        soloFlag = False
-
-        for i in self.spList.keys():
-            self.spInfo[i] = self.spList[i].sp_info()
-            if self.spInfo[i]["Solo"] == True:
-                soloFlag = True
-            self.mixerHWinfo[i] = {}
-
-        # setting mute flags
-        # if outLevel == -48, mute every channel.
-        self.outLevel = self.masterPanel.master_level()
-        if self.outLevel == -48: # mute all the channels
-            for i in self.spList.keys():
-                self.mixerHWinfo[i]["mute"] = True
-        else:
-            for i in self.spList.keys():
-                self.mixerHWinfo[i]["mute"] = False
-
-            # if some channels have solo flags, mute non-solo channels
-            if soloFlag == True:
-                for i in self.spList.keys():
-                    if self.spInfo[i]["Solo"] == False:
-                        self.mixerHWinfo[i]["mute"] = True
-
-            # if the channel has mute flag or its level = -48, mute it even it has solo flag.
-            for i in self.spList.keys():
-                if self.spInfo[i]["Mute"] == True or self.spInfo[i]["Level"] == -48:
-                    self.mixerHWinfo[i]["mute"] = True
-
-        # now mute flags are setup. calculation starts.
-        # first for input channels.
-        oLevel = {}
-        msg = {"left":[], "right":[]}
-        for i in range(0, HWdata["mixerChannel_Num"]):
-            if self.mixerHWinfo[i]["mute"] == True:
-                oLevel["left"] =  0
-                oLevel["right"] =  0
-            else:
-                # otherwise: inputlevel * outlevel * pan(cos/sin), then make it stepwise of 10^(1/200)
-                thruLevel = 0x2000 * math.pow(self.db, (self.spInfo[i]["Level"] + self.outLevel))
-                theta = ((self.spInfo[i]["Pan"]
-                          - HWdata["mixerPan_Range"]["Min"])/self.panRange) * math.pi/2
-
-                oLevel["left"]  =  thruLevel * math.cos (theta)
-                oLevel["right"] =  thruLevel * math.sin (theta)
-                
-            for each in ["left", "right"]:
-                if oLevel[each] < 100:
-                    self.mixerHWinfo[i][each] = int(oLevel[each])
-                else:
-                    self.mixerHWinfo[i][each] = int(0x2000 * math.pow(self.step, round(math.log(oLevel[each]/0x2000, self.step))))
-
-                # preparing message to be sent to HW
-                upperByte = self.mixerHWinfo[i][each] >> 8
-                lowerByte = self.mixerHWinfo[i][each] - (upperByte << 8)
-                msg[each].append(upperByte)
-                msg[each].append(lowerByte)
-
-        # calculation fo swr channel. in output message, it is treated as two channels,
-        # one for left, the other is for right, so it should be handled separately.
-        if self.mixerHWinfo[HWdata["mixerChannel_SWR"]]["mute"] == True:
-            thruLevel = 0
-        else:
-            # fortunately swr has no pan, so it is much simpler
-            thruLevel =  int(0x2000 * math.pow(self.db, self.spInfo[HWdata["mixerChannel_SWR"]]["Level"] + self.outLevel))
-
-        upperByte = thruLevel >> 8
-        lowerByte = thruLevel - (upperByte << 8)
-        msg["left"].append(upperByte)
-        msg["left"].append(lowerByte)
-        msg["left"].append(int(0))
-        msg["left"].append(int(0))
-
-        msg["right"].append(int(0))
-        msg["right"].append(int(0))
-        msg["right"].append(upperByte)
-        msg["right"].append(lowerByte)
-
-        if OFFLINE == False:
-            resL = dev.ctrl_transfer(0x40, HWdata["mixerHWset_Request"], 0,
-                                     self.index * 2,     msg["left"])
-            resR = dev.ctrl_transfer(0x40, HWdata["mixerHWset_Request"], 0,
-                                     self.index * 2 + 1, msg["right"])
+            each.update(changed)
+        self.masterPanel.update(changed)
+
+    def setmixer(self, channel = None): # computed from the register file, which holds every
+                                        # change of any view at once (see ManestroneCore.push_mixer).
+                                        # no read from hardware, so a fader move costs
+                                        # only the two mixerHWset transfers.
+                                        # "channel" is the strip whose level, pan or mute changed:
+                                        # only that channel is recomputed. None means every channel
+                                        # (solo or master change).
+        core.push_mixer(self.index, channel)
 
 class mixerWindow(wx.Frame):
 
@@ -512,31 +373,18 @@ class mixerWindow(wx.Frame):
         #                    "Thanks to take_control by stefanocoding", programName)
 
     def OnMenuIn(self, e):
-        if (self.mainbody.inputSection.Show(True) == False):
-            self.mainbody.inputSection.Show(False)
-            self.mainbody.inputP.Show(True)
-        else:
-            self.mainbody.inputP.Show(False)
+        self.mainbody.OnMenuIn(e)
         
     def OnMenuOut(self, e):
-        if (self.mainbody.outputSection.Show(True) == False):
-            self.mainbody.outputSection.Show(False)
-            self.mainbody.outputP.Show(True)
-        else:
-            self.mainbody.outputP.Show(False)
+        self.mainbody.OnMenuOut(e)
         
     def OnMenuMix(self, e):
-        if (self.mainbody.mixerSection.Show(True) == False):
-            self.mainbody.mixerSection.Show(False)
-            for each in self.mainbody.mplist:
-                each.Show(True)
-        else:
-            for each in self.mainbody.mplist:
-                each.Show(False)
+        self.mainbody.OnMenuMix(e)
         
     def OnMenuDMix(self, e):
         for each in self.mplist:
             each.toggle_dInput()
+        self.mainbody.on_view_changed()
         
     def OnExit(self, e):
         # do not forget to close the update loop (thread)
@@ -544,9 +392,9 @@ class mixerWindow(wx.Frame):
         self.mainbody.Close(True)
         exit(0)
 
-    def update(self):
+    def update(self, changed = None):
         for each in self.mplist:
-            each.update()
+            each.update(changed)
 
     def OnClose(self, event):
         self.OnMenuMix(event)
@@ -618,26 +466,26 @@ class inputPanel(wx.Panel):
         self.Phantom.Bind(wx.EVT_TOGGLEBUTTON, self.on_phantom_toggled)
         self.Group.Bind(wx.EVT_CHOICE, self.on_input_group_changed)
 
+        self.regs = set() # registers shown in this panel (see update)
+        self.stale = False
+        for request in ["inputType_Request", "softLimit_Request", "phantom_Request",
+                        "micLevel_Request", "instLevel_Request", "inputGroup_Request"]:
+            self.regs.add((request, 0, self.index))
+
         self.update()
 
     def get_input_info(self): # for "info", see "ApogeeDevices".
 
-        if OFFLINE == True:
-            self.itype = self.Type.GetSelection()
-            self.softlimit = self.SoftLimit.GetValue()
-            self.phantom = self.Phantom.GetValue()
-            self.miclevel = self.MicLevel.GetValue()
-            self.instlevel = self.InstLevel.GetValue()
-            self.group = self.Group.GetSelection()
-        else:
-            self.itype = get_dev_value("inputType_Request", 0, self.index)
-            self.softlimit = get_dev_value("softLimit_Request", 0, self.index)
-            self.phantom = get_dev_value("phantom_Request", 0, self.index)
-            self.miclevel = get_dev_value("micLevel_Request", 0, self.index)
-            self.instlevel = get_dev_value("instLevel_Request", 0, self.index)
-            self.group = get_dev_value("inputGroup_Request", 0, self.index)
-
-    def update(self):
+        self.itype = get_dev_value("inputType_Request", 0, self.index)
+        self.softlimit = get_dev_value("softLimit_Request", 0, self.index)
+        self.phantom = get_dev_value("phantom_Request", 0, self.index)
+        self.miclevel = get_dev_value("micLevel_Request", 0, self.index)
+        self.instlevel = get_dev_value("instLevel_Request", 0, self.index)
+        self.group = get_dev_value("inputGroup_Request", 0, self.index)
+
+    def update(self, changed = None):
+        if not need_update(self, changed):
+            return
         self.get_input_info()
         self.Type.SetSelection(self.itype)
 
@@ -737,9 +585,9 @@ class inputsPanel(wx.Panel):
 
         self.Layout()
 
-    def update(self):
+    def update(self, changed = None):
         for each in self.panel:
-            each.update()
+            each.update(changed)
     
 class inputWindow(wx.Frame):
 
@@ -793,27 +641,13 @@ class inputWindow(wx.Frame):
         #                    "Thanks to take_control by stefanocoding", programName)
 
     def OnMenuIn(self, e):
-        if (self.mainbody.inputSection.Show(True) == False):
-            self.mainbody.inputSection.Show(False)
-            self.mainbody.inputP.Show(True)
-        else:
-            self.mainbody.inputP.Show(False)
+        self.mainbody.OnMenuIn(e)
         
     def OnMenuOut(self, e):
-        if (self.mainbody.outputSection.Show(True) == False):
-            self.mainbody.outputSection.Show(False)
-            self.mainbody.outputP.Show(True)
-        else:
-            self.mainbody.outputP.Show(False)
+        self.mainbody.OnMenuOut(e)
         
     def OnMenuMix(self, e):
-        if (self.mainbody.mixerSection.Show(True) == False):
-            self.mainbody.mixerSection.Show(False)
-            for each in self.mainbody.mplist:
-                each.Show(True)
-        else:
-            for each in self.mainbody.mplist:
-                each.Show(False)
+        self.mainbody.OnMenuMix(e)
         
     def OnExit(self, e):
         # do not forget to close the update loop (thread)
@@ -821,8 +655,8 @@ class inputWindow(wx.Frame):
         self.mainbody.Close(True)
         exit(0)
 
-    def update(self):
-        self.panel.update()
+    def update(self, changed = None):
+        self.panel.update(changed)
     
     def OnClose(self, event):
         self.OnMenuIn(event)
@@ -905,34 +739,37 @@ class speakerPanel(wx.Panel): # used for both speaker and headphone
         if self.Speaker == True:
             self.Config.Bind(wx.EVT_CHOICE, self.on_output_config_changed)
 
+        self.regs = set() # registers shown in this panel (see update)
+        self.stale = False
+        for request in ["outputLevel_Request", "outputMute_Request",
+                        "outputDim_Request", "outputMono_Request"]:
+            self.regs.add((request, 0, self.index))
+        if self.Speaker == True:
+            self.regs.add(("output_Line_Request", 0, self.index))
+            self.regs.add(("outputConfig_Request", 0, self.index))
+        else:
+            self.regs.add(("outputSource_Request", 0, HWdata["outputSource_Dest"][self.index]))
+
         self.update()
 
     def get_info(self): # for "info", see "ApogeeDevices".
 
-        if OFFLINE == True:
-            self.level = self.Level.GetValue()
-            self.mute = self.Mute.GetValue()
-            self.dim = self.Dim.GetValue()
-            self.mono = self.Mono.GetValue()
+        self.level = -(get_dev_value("outputLevel_Request", 0, self.index))
+        self.mute = get_dev_value("outputMute_Request", 0, self.index)
+        self.dim =  get_dev_value("outputDim_Request",  0, self.index)
+        self.mono = get_dev_value("outputMono_Request", 0, self.index)
 
-            self.source = max(0, self.Source.GetSelection())
-            if self.Speaker == True:
-                self.config = self.Config.GetSelection()
+        if self.Speaker == True:
+            self.source = get_dev_value("output_Line_Request", 0, self.index)
+            self.config = get_dev_value("outputConfig_Request", 0, self.index)
         else:
-            self.level = -(get_dev_value("outputLevel_Request", 0, self.index))
-            self.mute = get_dev_value("outputMute_Request", 0, self.index)
-            self.dim =  get_dev_value("outputDim_Request",  0, self.index)
-            self.mono = get_dev_value("outputMono_Request", 0, self.index)
-
-            if self.Speaker == True:
-                self.source = get_dev_value("output_Line_Request", 0, self.index)
-                self.config = get_dev_value("outputConfig_Request", 0, self.index)
-            else:
-                self.source = get_dev_value("outputSource_Request", 0,
-                                            HWdata["outputSource_Dest"][self.index])
+            self.source = get_dev_value("outputSource_Request", 0,
+                                        HWdata["outputSource_Dest"][self.index])
 
             
-    def update(self):
+    def update(self, changed = None):
+        if not need_update(self, changed):
+            return
         self.get_info()
 
         self.Level.SetValue(self.level)
@@ -1016,23 +853,29 @@ class linePanel(wx.Panel):
         self.Source.Bind(wx.EVT_CHOICE, self.on_output_source_changed)
         self.LineLevel.Bind(wx.EVT_CHOICE, self.on_line_level_changed)
 
+        self.regs = set([("outputSource_Request", 0, HWdata["outputSource_Dest"][self.index]),
+                         ("outputLineLevel_Request", 0, self.lineIndex),
+                         ("outputLineLevel_Request", 0, self.lineIndex + 1)]) # see update
+        self.stale = False
+
         self.update()
 
     def get_output_info(self): # for "info", see "ApogeeDevices".
 
-        if OFFLINE == False:
-            self.source = get_dev_value("outputSource_Request", 0,
-                                        HWdata["outputSource_Dest"][self.index])
-            self.lineLevel  = get_dev_value("outputLineLevel_Request", 0,
-                                            self.lineIndex)     #  for Line [0, (not used), 4, 2]
-            self.lineLevel2 = get_dev_value("outputLineLevel_Request", 0,
-                                            self.lineIndex + 1) #  for Line [1, (not used), 5, 3]
-            if (self.lineLevel != self.lineLevel2):
-                print ("line level of Line " + str(self.lineIndex) + ": "
-                       + str(self.lineLevel) + " and " + str(self.lineIndex + 1)
-                       + ": " + str(self.lineLevel2) + " differs!")
-
-    def update(self):
+        self.source = get_dev_value("outputSource_Request", 0,
+                                    HWdata["outputSource_Dest"][self.index])
+        self.lineLevel  = get_dev_value("outputLineLevel_Request", 0,
+                                        self.lineIndex)     #  for Line [0, (not used), 4, 2]
+        self.lineLevel2 = get_dev_value("outputLineLevel_Request", 0,
+                                        self.lineIndex + 1) #  for Line [1, (not used), 5, 3]
+        if (self.lineLevel != self.lineLevel2):
+            print ("line level of Line " + str(self.lineIndex) + ": "
+                   + str(self.lineLevel) + " and " + str(self.lineIndex + 1)
+                   + ": " + str(self.lineLevel2) + " differs!")
+
+    def update(self, changed = None):
+        if not need_update(self, changed):
+            return
         self.get_output_info()
         self.Source.SetSelection(self.source)
         self.LineLevel.SetSelection(self.lineLevel)
@@ -1069,9 +912,9 @@ class outputPanel(wx.Panel):
 
         self.Layout()
 
-    def update(self):
+    def update(self, changed = None):
         for each in self.panel:
-            each.update()
+            each.update(changed)
 
         self.Layout()
             
@@ -1128,27 +971,13 @@ class outputWindow(wx.Frame):
         #                    "Thanks to take_control by stefanocoding", programName)
 
     def OnMenuIn(self, e):
-        if (self.mainbody.inputSection.Show(True) == False):
-            self.mainbody.inputSection.Show(False)
-            self.mainbody.inputP.Show(True)
-        else:
-            self.mainbody.inputP.Show(False)
+        self.mainbody.OnMenuIn(e)
         
     def OnMenuOut(self, e):
-        if (self.mainbody.outputSection.Show(True) == False):
-            self.mainbody.outputSection.Show(False)
-            self.mainbody.outputP.Show(True)
-        else:
-            self.mainbody.outputP.Show(False)
+        self.mainbody.OnMenuOut(e)
         
     def OnMenuMix(self, e):
-        if (self.mainbody.mixerSection.Show(True) == False):
-            self.mainbody.mixerSection.Show(False)
-            for each in self.mainbody.mplist:
-                each.Show(True)
-        else:
-            for each in self.mainbody.mplist:
-                each.Show(False)
+        self.mainbody.OnMenuMix(e)
         
     def OnExit(self, e):
         # do not forget to close the update loop (thread)
@@ -1156,8 +985,8 @@ class outputWindow(wx.Frame):
         self.mainbody.Close(True)
         exit(0)
 
-    def update(self):
-        self.panel.update()
+    def update(self, changed = None):
+        self.panel.update(changed)
 
         self.Layout()
         #self.Show()
@@ -1170,15 +999,15 @@ class outputWindow(wx.Frame):
 class mainWindow(wx.Frame):
 
     def __init__(self, parent, title):
-        global dev
         global HWdata
         wx.Frame.__init__(self, parent, title=title, size = mainWindowSize)
+        startTime = time.perf_counter()
 
-        if (OFFLINE):
+        if (OFFLINE): # every path of device access works on the simulator, too.
             HWdata = ApogeeDevices[0]
-            dev = None
+            dev = ManestroneSim.quartetSim(HWdata)
         else:
-            find_result = self.find_device()
+            find_result = core.find_device()
             if find_result is None:
                 print("No Apogee device found!")
                 exit(1)
@@ -1186,7 +1015,21 @@ class mainWindow(wx.Frame):
             dev = find_result[0]
             HWdata =  find_result[1]
 
+        core.bind_device(dev, HWdata)
         print(HWdata["ProductName"] + " found!")
+        # panels below are built from the register file. it is filled from the state saved
+        # at last exit, and reconciled with the device in background (ManestroneCore.pollThread),
+        # or if there is none, every register is read once here.
+        self.reconcile = core.load_dev_state()
+        snapshot = (0, 0)
+        if not self.reconcile:
+            try:
+                snapshot = core.snapshot_dev_state(core.snapshotBudget)
+            except Exception as e: # panels show registers read so far, polling reads again.
+                print("could not read the device: " + str(e))
+                core.seed_dev_state()
+                self.reconcile = True
+        core.take_changes()
 
         self.SetTitle(HWdata["ProductName"] + " Control Panel")
 
@@ -1210,9 +1053,13 @@ class mainWindow(wx.Frame):
             self.notebook.InsertPage(pageIndex, mp, "Mixer " + str(mixerindex + 1))
             pageIndex = pageIndex + 1
 
-        self.inputSection = inputWindow(self, self)
-        self.outputSection = outputWindow(self, self)
-        self.mixerSection =mixerWindow(self, self)
+        # detached windows are built the first time they are shown (see section)
+        self.inputSection = None
+        self.outputSection = None
+        self.mixerSection = None
+
+        # only registers shown on screen are polled and displayed (see show_changed)
+        self.notebook.Bind(wx.EVT_NOTEBOOK_PAGE_CHANGED, self.on_view_changed)
 
         # menu part
 
@@ -1253,39 +1100,74 @@ class mainWindow(wx.Frame):
         # periodically update, using threading.
         # "Close" button sends an event to terminate the looping thread.
 
+        # polling thread only reads hardware. display is updated on GUI thread (apply_changes).
+        # interval adapts to activity of the device (see ManestroneCore.pollSchedule).
+
         self.event = threading.Event()
-        thread = threading.Thread(target = self.periodic_update)
-        thread.start()
+        self.poller = core.pollThread(self.periodic_update, self.reconcile, updateInterval)
+        self.Bind(wx.EVT_ICONIZE, self.OnIconize)
+        self.poller.start()
+        self.on_view_changed()
+
+        print("startup: %d registers read in %.1f ms, %d transfers in %.1f ms in total"
+              % (snapshot[0], snapshot[1] * 1000,
+                 core.HWstats["reads"] + core.HWstats["writes"],
+                 (time.perf_counter() - startTime) * 1000))
         
-    def periodic_update(self):
-        while not self.event.wait(timeout = updateInterval):
-            #if (OFFLINE == False):
-            self.update()
+    def periodic_update(self, changed): # called by polling thread, once per tick with changes
+        wx.CallAfter(self.apply_changes, changed)
 
-    def find_device(self):
-        dev = None
-        for apogeeinfo in ApogeeDevices:
-            dev = usb.core.find(idVendor = apogeeinfo["VendorID"],
-                                idProduct = apogeeinfo["ProductID"])
-        if (dev != None):
-            return [dev, apogeeinfo]
+    def OnIconize(self, e):
+        if e.IsIconized(): # polling is suspended while main window is iconized
+            self.poller.suspend()
+        else:
+            self.poller.resume()
+        e.Skip()
 
-        return None
+    def apply_changes(self, changed): # runs on GUI thread, once per tick.
+                                      # only the panels showing changed registers are updated.
+        if self.event.is_set(): # closing
+            return
+        frames = [self] + self.sections()
+        for each in frames:
+            each.Freeze()
+        try:
+            self.update(changed)
+        finally:
+            for each in frames:
+                each.Thaw()
 
     def OnAbout(self, e):
         dlg = wx.MessageBox("Apogee Devices Control Panel\n\n"
                             "built on WxPython and PyUSB\n\n"
                             "Thanks to take_control by stefanocoding", programName)
 
+    def section(self, name): # detached window "inputSection", "outputSection" or "mixerSection".
+                             # built the first time it is needed.
+        if getattr(self, name) is None:
+            if name == "inputSection":
+                frame = inputWindow(self, self)
+            elif name == "outputSection":
+                frame = outputWindow(self, self)
+            else:
+                frame = mixerWindow(self, self)
+            frame.Bind(wx.EVT_SHOW, self.on_view_changed)
+            setattr(self, name, frame)
+        return getattr(self, name)
+
+    def sections(self): # detached windows built so far
+        return [each for each in [self.inputSection, self.outputSection, self.mixerSection]
+                if each is not None]
+
     def OnMenuIn(self, e):
-        if (self.inputSection.Show(True) == False):
+        if (self.section("inputSection").Show(True) == False):
             self.inputSection.Show(False)
             self.inputP.Show(True)
         else:
             self.inputP.Show(False)
         
     def OnMenuOut(self, e):
-        if (self.outputSection.Show(True) == False):
+        if (self.section("outputSection").Show(True) == False):
             self.outputSection.Show(False)
             self.outputP.Show(True)
         else:
@@ -1294,9 +1176,10 @@ class mainWindow(wx.Frame):
     def OnMenuDMix(self, e):
         for each in self.mplist:
             each.toggle_dInput()
+        self.on_view_changed()
 
     def OnMenuMix(self, e):
-        if (self.mixerSection.Show(True) == False):
+        if (self.section("mixerSection").Show(True) == False):
             self.mixerSection.Show(False)
             for each in self.mplist:
                 each.Show(True)
@@ -1304,23 +1187,64 @@ class mainWindow(wx.Frame):
             for each in self.mplist:
                 each.Show(False)
         
-    def update(self):
-        self.inputSection.update()
-        self.outputSection.update()
-        self.mixerSection.update() # mixer setting cannot be changed by HW - maybe no need to update
-        self.inputP.update()
-        self.outputP.update()
+    def mixer_panels(self): # every mixer panel, of the main window and of the mixer window
+        mplist = self.mplist
+        if self.mixerSection is not None:
+            mplist = mplist + self.mixerSection.mplist
+        return mplist
+
+    def panels(self): # every panel which shows registers
+        panels = self.inputP.panel + self.outputP.panel
+        if self.inputSection is not None:
+            panels = panels + self.inputSection.panel.panel
+        if self.outputSection is not None:
+            panels = panels + self.outputSection.panel.panel
+        for mp in self.mixer_panels():
+            panels = panels + list(mp.spList.values()) + [mp.masterPanel]
+        return panels
+
+    def on_view_changed(self, e = None): # a window, a tab or digital inputs are shown or hidden
+        if e is not None:
+            e.Skip()
+        wx.CallAfter(self.show_changed) # after the change takes effect
+
+    def show_changed(self): # catches up panels now shown, and polls only registers on screen.
+                            # every register of a mixer shown is polled, even of hidden strips
+                            # (digital inputs), as its message is sent from all of them.
+        if self.event.is_set(): # closing
+            return
+        regs = set()
+        for each in self.panels():
+            if each.IsShownOnScreen():
+                if each.stale == True:
+                    each.update()
+                regs |= each.regs
+        for mp in self.mixer_panels():
+            if mp.IsShownOnScreen():
+                for each in list(mp.spList.values()) + [mp.masterPanel]:
+                    regs |= each.regs
+        self.poller.keys = sorted(regs)
+
+    def update(self, changed = None): # views read only the register file.
+        for each in self.sections(): # mixer setting cannot be changed by HW - maybe no need to update
+            each.update(changed)
+        self.inputP.update(changed)
+        self.outputP.update(changed)
         for each in self.mplist:
-            each.update()
+            each.update(changed)
 
     def OnClose(self, e):
         # do not forget to close the update loop (thread)
         self.event.set()
+        self.poller.stop()
+        core.flush_writes()
+        core.save_dev_state()
         e.Skip()
         
     def OnExit(self, e):
         # do not forget to close the update loop (thread)
         self.event.set()
+        self.poller.stop()
         self.Close(True)
         exit(0)
 
@@ -0,0 +1,282 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ManestroneBench.py
+#
+# Copyright (C) 2021  SUZUDO Yasushi  <yasushi_suzudo@yahoo.co.jp>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+
+# benchmark of Manestrone against the simulated device (ManestroneSim.py):
+#  mixer     : payload computations per second (ManestroneCore.mixerEngine)
+#  ticks     : control transfers and wall time per polling tick (ManestroneCore.pollThread)
+#  fader     : transfers and latency per mixer fader event, until its mixerHWset is sent
+#  startup   : transfers and time until panels can be drawn, without and with saved state
+#  faults    : polling and GUI-side blocking under injected USB faults
+# neither wx nor apogee device is needed. GUI code paths are followed with ManestroneCore calls.
+# "--json" prints results as JSON, to be compared release to release.
+# "--replay" uses a recording of a real device (see ManestroneRecord.py) instead of the simulator,
+# with recorded duration of each transfer (fault scenarios still run on the simulator).
+#
+#  usage: python3 ManestroneBench.py [seconds per case] [--latency msec per transfer]
+#                                    [--replay recording] [--json]
+
+import sys
+import json
+import time
+import random
+import tempfile
+import ManestroneCore as core
+import ManestroneSim
+import ManestroneRecord
+
+replayFile = None # recording to replay instead of the simulator (see new_device)
+
+def random_state(HWdata, rnd): # compact mixer state, see ManestroneCore.mixerEngine
+    levelRange = HWdata["mixerLevel_Range"]
+    panRange = HWdata["mixerPan_Range"]
+    channels = range(0, HWdata["mixerChannel_Num"] + 1) # inputs and software return
+    return {"Level":[rnd.randint(levelRange["Min"] + 1, levelRange["Max"]) for i in channels],
+            "Pan":[rnd.randint(panRange["Min"], panRange["Max"])
+                   for i in range(0, HWdata["mixerChannel_Num"])],
+            "Solo":[0 for i in channels],
+            "Mute":[0 for i in channels],
+            "Master":0}
+
+def rate(func, seconds): # calls per second
+    count = 0
+    start = time.perf_counter()
+    elapsed = 0
+    while elapsed < seconds:
+        for i in range(0, 100):
+            func()
+        count += 100
+        elapsed = time.perf_counter() - start
+    return count / elapsed
+
+def bench_mixer(seconds = 1.0): # payload computations per second
+    HWdata = core.Quartet
+    engine = core.mixerEngine(HWdata)
+    rnd = random.Random(0)
+    states = [random_state(HWdata, rnd) for i in range(0, HWdata["mixer_Num"])]
+    payload = engine.payload(states[0])
+
+    results = {}
+    results["payload"] = rate(lambda: engine.payload(states[0]), seconds)
+    results["payloads_all_mixers"] = rate(lambda: engine.payloads(states), seconds)
+    results["set_channel"] = rate(lambda: engine.set_channel(payload, states[0], 0), seconds)
+    return results
+
+def transfers(sim): # control transfers done by the simulated device so far
+    return sim.stats["reads"] + sim.stats["writes"]
+
+def new_device(latency = 0.0): # simulated device, or replay of a recording
+    if replayFile is not None:
+        return ManestroneRecord.replayDevice(replayFile, timing = True)
+    return ManestroneSim.quartetSim(notify = False, latency = latency)
+
+def bind_sim(latency = 0.0): # simulated device, bound with its state read
+    sim = new_device(latency)
+    core.bind_device(sim, core.Quartet)
+    core.snapshot_dev_state()
+    core.take_changes()
+    sim.reset_stats()
+    return sim
+
+def unbind():
+    if core.HWnotify is not None:
+        core.HWnotify.stop()
+
+def bench_ticks(ticks = 50, latency = 0.0): # polling of every register (all views shown)
+    sim = bind_sim(latency)
+    poller = core.pollThread(lambda changed: None)
+    results = {}
+    for name, count in [("first", 1),        # every tier is due
+                        ("steady", ticks)]:  # only "hardware" tier, as the others are not due yet
+        sim.reset_stats()
+        start = time.perf_counter()
+        for i in range(0, count):
+            poller.tick()
+        elapsed = time.perf_counter() - start
+        results[name] = {"transfersPerTick":transfers(sim) / count,
+                         "secondsPerTick":elapsed / count}
+    unbind()
+    return results
+
+def bench_fader(events = 200, latency = 0.0): # as on_mixer_levelslider_changed -> setmixer
+    sim = bind_sim(latency)
+    mixerindex = 0
+    channel = 3
+    levelRange = core.Quartet["mixerLevel_Range"]
+    core.set_dev_values([["mixerPan_Request", mixerindex, channel,   # center, so both sides change
+                          -core.Quartet["mixerPan_Range"]["Min"]],
+                         ["mixerLevel_Request", mixerindex,          # master at 0 dB
+                          core.Quartet["mixerChannel_Master"], -levelRange["Min"]]])
+    core.flush_writes()
+    payload = core.HWmixer.payload(core.mixer_state(mixerindex))
+    sim.reset_stats()
+    latencies = []
+    for i in range(0, events):
+        start = time.perf_counter()
+        core.set_dev_value("mixerLevel_Request", mixerindex, channel,
+                           i % (levelRange["Max"] - levelRange["Min"] + 1))
+        core.HWmixer.set_channel(payload, core.mixer_state(mixerindex), channel)
+        core.set_mixer_payload(mixerindex, payload)
+        while core.HWio.pending or core.HWio.sending: # until the device has got it
+            time.sleep(0.0001)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    unbind()
+    return {"transfersPerEvent":transfers(sim) / events,
+            "mixerHWsetPerEvent":sim.stats["requests"].get("mixerHWset_Request", 0) / events,
+            "latencyMean":sum(latencies) / events,
+            "latency95":latencies[int(events * 0.95) - 1],
+            "latencyMax":latencies[-1]}
+
+def bench_startup(latency = 0.0): # as mainWindow.__init__: transfers and time until panels
+                                  # can be drawn (register file filled), first and next launch
+    results = {}
+    cacheDir = core.stateCacheDir
+    with tempfile.TemporaryDirectory() as tmp:
+        core.stateCacheDir = tmp
+        try:
+            for name in ["cold", "warm"]: # without, and with saved state
+                sim = new_device(latency)
+                start = time.perf_counter()
+                core.bind_device(sim, core.Quartet)
+                if not core.load_dev_state():
+                    core.snapshot_dev_state()
+                core.take_changes()
+                results[name] = {"transfers":transfers(sim),
+                                 "seconds":time.perf_counter() - start}
+                if name == "warm": # read by polling thread after panels are drawn
+                    reconcile = core.snapshot_dev_state()
+                    results[name]["reconcileTransfers"] = reconcile[0]
+                    results[name]["reconcileSeconds"] = reconcile[1]
+                core.save_dev_state()
+                unbind()
+        finally:
+            core.stateCacheDir = cacheDir
+    return results
+
+faultScenarios = {"timeout":[("timeout", {"start":200, "every":40})],
+                  "error":[("error", {"probability":0.05})],
+                  "slow":[("slow", {"every":10, "delay":0.05})],
+                  "gone":[("gone", {"start":400, "count":1})]} # reconnected at half time
+
+class fixedSchedule(core.pollSchedule): # polls every "interval" sec, without backing off while idle,
+                                        # so polling is exercised all through a fault scenario
+    def __init__(self, interval):
+        core.pollSchedule.__init__(self)
+        self.interval = interval
+
+    def next_interval(self, changed):
+        return self.interval
+
+faultInterval = 0.02 # interval (sec) of polling in fault scenarios
+
+def bench_faults(seconds = 1.0): # per scenario: polling ticks done and failed, and the longest
+                                 # time a GUI-side call (fader move, read of a new register) blocked
+    results = {}
+    for name, faults in faultScenarios.items():
+        sim = ManestroneSim.quartetSim()
+        core.bind_device(sim, core.Quartet)
+        core.snapshot_dev_state()
+        core.take_changes()
+        for kind, rule in faults:
+            sim.inject(kind, **rule)
+        poller = core.pollThread(lambda changed: None, interval = faultInterval)
+        poller.schedule = fixedSchedule(faultInterval)
+        errors = core.HWstats["errors"]
+        poller.start()
+
+        blocked = 0
+        start = time.perf_counter()
+        level = 0
+        reconnected = False
+        while time.perf_counter() - start < seconds:
+            if name == "gone" and not reconnected and time.perf_counter() - start > seconds / 2:
+                sim.reconnect()
+                reconnected = True
+            level = (level + 1) % 55
+            t = time.perf_counter()
+            core.set_dev_value("mixerLevel_Request", 0, 0, level) # as on_mixer_levelslider_changed
+            core.push_mixer(0, 0)
+            core.HWregs.pop(("phase_Request", 0, 0), None) # not polled, so read on each access
+            core.get_dev_value("phase_Request", 0, 0)
+            blocked = max(blocked, time.perf_counter() - t)
+            time.sleep(0.005)
+        elapsed = time.perf_counter() - start
+        poller.stop()
+        poller.thread.join()
+        core.flush_writes()
+        results[name] = {"ticks":poller.ticks, "failedTicks":poller.errors,
+                         "ticksPerSecond":(poller.ticks + poller.errors) / elapsed,
+                         "deviceErrors":core.HWstats["errors"] - errors, # a tick skips
+                                                          # registers failed, and is not failed
+                         "pollerAlive":poller.error is None,
+                         "maxBlocked":blocked, "budget":core.callBudget,
+                         "faults":sim.stats["faults"]}
+        unbind()
+    return results
+
+def bench_all(seconds = 1.0, latency = 0.0):
+    return {"numpy":core.numpy is not None,
+            "latency":latency,
+            "replay":replayFile,
+            "mixer":bench_mixer(seconds),
+            "ticks":bench_ticks(latency = latency),
+            "fader":bench_fader(latency = latency),
+            "startup":bench_startup(latency),
+            "faults":bench_faults(seconds)}
+
+def print_results(results):
+    print("numpy: " + ("yes" if results["numpy"] else "no")
+          + ", latency per transfer: %.2f ms" % (results["latency"] * 1000))
+    for name, value in results["mixer"].items():
+        print("%-24s %12.0f /s" % (name, value))
+    for name, value in results["ticks"].items():
+        print("tick %-8s %6.1f transfers, %8.2f ms"
+              % (name, value["transfersPerTick"], value["secondsPerTick"] * 1000))
+    fader = results["fader"]
+    print("fader event     %6.1f transfers (mixerHWset %.1f), latency %.2f ms (95%% %.2f, max %.2f)"
+          % (fader["transfersPerEvent"], fader["mixerHWsetPerEvent"], fader["latencyMean"] * 1000,
+             fader["latency95"] * 1000, fader["latencyMax"] * 1000))
+    for name, value in results["startup"].items():
+        print("startup %-5s %6d transfers, %8.2f ms"
+              % (name, value["transfers"], value["seconds"] * 1000))
+    for name, value in results["faults"].items():
+        print("faults %-8s ticks %4d (%5.1f /s), failed %3d, device errors %4d, "
+              "polling works: %-5s, GUI blocked %6.1f ms at most"
+              % (name, value["ticks"], value["ticksPerSecond"], value["failedTicks"],
+                 value["deviceErrors"], value["pollerAlive"], value["maxBlocked"] * 1000))
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    asJson = "--json" in args
+    if asJson:
+        args.remove("--json")
+    latency = 0.0
+    if "--latency" in args:
+        i = args.index("--latency")
+        latency = float(args[i + 1]) / 1000
+        del args[i:i + 2]
+    if "--replay" in args:
+        i = args.index("--replay")
+        replayFile = args[i + 1]
+        del args[i:i + 2]
+    seconds = 1.0
+    if args:
+        seconds = float(args[0])
+
+    if asJson: # messages of device access go to stderr, so stdout is JSON only
+        stdout = sys.stdout
+        sys.stdout = sys.stderr
+        results = bench_all(seconds, latency)
+        sys.stdout = stdout
+        print(json.dumps(results, indent = 1, sort_keys = True))
+    else:
+        print_results(bench_all(seconds, latency))
@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ManestroneCli.py
+#
+# Copyright (C) 2021  SUZUDO Yasushi  <yasushi_suzudo@yahoo.co.jp>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+
+# command line get/set of device settings. all arguments are applied in one session:
+# device is found once, writes are coalesced (ManestroneCore.ioWorker), and each mixer touched
+# gets one mixerHWset message at the end (ManestroneCore.set_dev_values).
+# if ManestroneDaemon.py is running, it is asked instead of opening the device.
+#
+#  usage: manestrone [--sim] [--list] name[=value] ...
+#   e.g.: manestrone mixer1.input3.level=-6 mixer1.input3.pan=20 output.headphone.source=4
+#
+# numbers of inputs, lines, mixers and mixer inputs start at 1, as printed on the device.
+# levels are in dB, choices are indices (from 0) of the choices shown by Manestrone04.py,
+# switches are 0 or 1.
+
+import sys
+import ManestroneCore as core
+
+class parameter:
+    # a setting known by name. it is one or more registers (written together, read from the first)
+    # with value converted between user and register.
+
+    def __init__(self, regs, low, high, encode = None, decode = None):
+        self.regs = regs          # [(request, wValue, wIndex)]
+        self.low = low            # range of user value
+        self.high = high
+        self.encode = encode      # user value -> register value. None: the same
+        self.decode = decode      # register value -> user value. None: the same
+
+    def values(self, value): # [request, wValue, wIndex, register value] to set user value
+        if value < self.low or value > self.high:
+            raise ValueError("%d is out of range (%d - %d)" % (value, self.low, self.high))
+        if self.encode is not None:
+            value = self.encode(value)
+        return [[request, wValue, wIndex, value] for request, wValue, wIndex in self.regs]
+
+    def value(self, regvalue): # user value from register value
+        if self.decode is not None:
+            return self.decode(regvalue)
+        return regvalue
+
+def parameters(HWdata): # name -> parameter, of every setting of the device
+    params = {}
+    def regs(request, wValue, wIndexes):
+        return [(request, wValue, wIndex) for wIndex in wIndexes]
+    def switch(request, wValue, wIndexes):
+        return parameter(regs(request, wValue, wIndexes), 0, 1)
+    def choice(request, wValue, wIndexes, choices):
+        return parameter(regs(request, wValue, wIndexes), 0, len(HWdata[choices]) - 1)
+
+    for index in range(0, HWdata["InputNum"]):
+        name = "input%d." % (index + 1)
+        params[name + "type"] = choice("inputType_Request", 0, [index], "inputType")
+        params[name + "softlimit"] = switch("softLimit_Request", 0, [index])
+        params[name + "phase"] = switch("phase_Request", 0, [index])
+        params[name + "phantom"] = switch("phantom_Request", 0, [index])
+        params[name + "group"] = choice("inputGroup_Request", 0, [index], "inputGroupChoice")
+        # mic and instrument level are set together, as Manestrone04.py does
+        levelMax = min(HWdata["micLevel_Range"]["Max"], HWdata["instLevel_Range"]["Max"])
+        params[name + "level"] = parameter([("micLevel_Request", 0, index),
+                                            ("instLevel_Request", 0, index)],
+                                           HWdata["micLevel_Range"]["Min"], levelMax)
+
+    levelMax = HWdata["outputLevel_Range"]["Max"]
+    for name, index in [("output.speaker.", HWdata["output_Speaker_Index"]),
+                        ("output.headphone.", HWdata["output_Headphone_Index"])]:
+        params[name + "level"] = parameter(regs("outputLevel_Request", 0, [index]),
+                                           HWdata["outputLevel_Range"]["Min"], levelMax,
+                                           lambda v: levelMax - v, lambda v: levelMax - v)
+        params[name + "mute"] = switch("outputMute_Request", 0, [index])
+        params[name + "dim"] = switch("outputDim_Request", 0, [index])
+        params[name + "mono"] = switch("outputMono_Request", 0, [index])
+    speaker = HWdata["output_Speaker_Index"]
+    params["output.speaker.source"] = parameter(regs("output_Line_Request", 0, [speaker]),
+                                                0, len(HWdata["output_SpSelectIndex"]) - 1,
+                                                lambda v: HWdata["output_SpSelectIndex"][v],
+                                                lambda v: HWdata["output_SpChoiceToIndex"][v])
+    params["output.speaker.config"] = choice("outputConfig_Request", 0, [speaker],
+                                             "outputConfigChoice")
+    params["output.headphone.source"] = choice("outputSource_Request", 0,
+                                               [HWdata["outputSource_Dest"]
+                                                [HWdata["output_Headphone_Index"]]],
+                                               "outputSourceChoice")
+    for number, index in enumerate(HWdata["output_Line_Index"]):
+        name = "line%d." % (number + 1)
+        dest = HWdata["outputSource_Dest"][index]
+        params[name + "source"] = choice("outputSource_Request", 0, [dest], "outputSourceChoice")
+        params[name + "level"] = choice("outputLineLevel_Request", 0, [dest * 2, dest * 2 + 1],
+                                        "outputLineLevelChoice")
+
+    levelRange = HWdata["mixerLevel_Range"]
+    panRange = HWdata["mixerPan_Range"]
+    for mixerindex in range(0, HWdata["mixer_Num"]):
+        channels = [("input%d." % (i + 1), i) for i in range(0, HWdata["mixerChannel_Num"])]
+        channels.append(("swr.", HWdata["mixerChannel_SWR"]))
+        for channelName, channel in channels:
+            name = "mixer%d.%s" % (mixerindex + 1, channelName)
+            params[name + "level"] = parameter(regs("mixerLevel_Request", mixerindex, [channel]),
+                                               levelRange["Min"], levelRange["Max"],
+                                               lambda v: v - levelRange["Min"],
+                                               lambda v: v + levelRange["Min"])
+            if channel < HWdata["mixerChannel_Num"]:
+                params[name + "pan"] = parameter(regs("mixerPan_Request", mixerindex, [channel]),
+                                                 panRange["Min"], panRange["Max"],
+                                                 lambda v: v - panRange["Min"],
+                                                 lambda v: v + panRange["Min"])
+            params[name + "solo"] = switch("mixerSolo_Request", mixerindex, [channel])
+            params[name + "mute"] = switch("mixerMute_Request", mixerindex, [channel])
+        name = "mixer%d." % (mixerindex + 1)
+        params[name + "swr.source"] = choice("mixerSoftRtn_Request", 0, [mixerindex],
+                                             "mixerSoftRtnChoice")
+        params[name + "master.level"] = parameter(regs("mixerLevel_Request", mixerindex,
+                                                       [HWdata["mixerChannel_Master"]]),
+                                                  levelRange["Min"], levelRange["Max"],
+                                                  lambda v: v - levelRange["Min"],
+                                                  lambda v: v + levelRange["Min"])
+    return params
+
+def parse(args, params): # returns (names to get, [request, wValue, wIndex, value] to set)
+    gets = []
+    sets = []
+    for arg in args:
+        name, sep, value = arg.partition("=")
+        if name not in params:
+            raise ValueError("unknown setting: " + name + " (see --list)")
+        if sep:
+            try:
+                sets += params[name].values(int(value))
+            except ValueError as e:
+                raise ValueError(name + ": " + str(e))
+        else:
+            gets.append(name)
+    return (gets, sets)
+
+def run_daemon(gets, sets, params): # through ManestroneDaemon.py. raises OSError if none is running
+    import ManestroneDaemon
+    regs = [list(params[name].regs[0]) for name in gets]
+    if sets:
+        reply = ManestroneDaemon.request({"cmd":"set", "values":sets})
+        if not reply["ok"]:
+            raise ValueError(reply["error"])
+    if not regs:
+        return []
+    reply = ManestroneDaemon.request({"cmd":"get", "regs":regs})
+    if not reply["ok"]:
+        raise ValueError(reply["error"])
+    return [value[3] for value in reply["values"]]
+
+def run_device(device, HWdata, gets, sets, params): # on the device directly.
+                                                    # raises OSError if a read or write failed
+    core.bind_device(device, HWdata)
+    try:
+        errors = core.HWstats["writeErrors"]
+        try:
+            core.set_dev_values(sets)
+        except OSError as e: # mixer settings could not be read, nothing is set
+            raise OSError("could not read the mixer: " + str(e))
+        if not core.flush_writes() or core.HWstats["writeErrors"] != errors:
+            raise OSError("could not write every setting to the device")
+        values = []
+        for name in gets:
+            try:
+                values.append(core.get_dev_value(*params[name].regs[0], strict = True))
+            except Exception as e:
+                raise OSError("could not read " + name + ": " + str(e))
+        return values
+    finally:
+        if core.HWnotify is not None:
+            core.HWnotify.stop()
+
+def main(args):
+    sim = "--sim" in args
+    if sim:
+        args.remove("--sim")
+    params = parameters(core.Quartet)
+    if "--list" in args:
+        for name in params:
+            print("%-28s %d - %d" % (name, params[name].low, params[name].high))
+        return 0
+    if not args:
+        print("usage: manestrone [--sim] [--list] name[=value] ...")
+        return 2
+    try:
+        gets, sets = parse(args, params)
+    except ValueError as e:
+        print(e)
+        return 2
+
+    try:
+        if sim:
+            import ManestroneSim
+            values = run_device(ManestroneSim.quartetSim(), core.Quartet, gets, sets, params)
+        else:
+            try:
+                values = run_daemon(gets, sets, params)
+            except OSError: # no daemon is running
+                found = core.find_device()
+                if found is None:
+                    print("No Apogee device found!")
+                    return 1
+                # other devices of ApogeeDevices may have other settings
+                params = parameters(found[1])
+                gets, sets = parse(args, params)
+                values = run_device(found[0], found[1], gets, sets, params)
+    except (ValueError, OSError) as e: # OSError: the device failed
+        print(e)
+        return 1
+
+    for name, value in zip(gets, values):
+        print("%s=%d" % (name, params[name].value(value)))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,981 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ManestroneCore.py
+#
+# Copyright (C) 2021  SUZUDO Yasushi  <yasushi_suzudo@yahoo.co.jp>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+
+# device profile, device access and mixer calculation of Manestrone.
+# nothing here depends on wx, so it can be used from headless tools.
+
+import os
+import json
+import math
+import time
+import heapq
+import threading
+try:
+    import usb.core
+except ImportError:  # not needed for mixerEngine alone
+    usb = None
+try:
+    import numpy      # optional. used for batch calculation of mixers (see mixerEngine.payloads)
+except ImportError:
+    numpy = None
+
+writeRate = 60       # maximum rate (per second) of writes to the device (see ioWorker)
+transferTimeout = 200 # timeout (msec) of a control transfer
+callBudget = 0.25    # longest time (sec) a caller other than polling waits for the device
+                     # (a register not read yet, see get_dev_value), so GUI never hangs on USB
+flushBudget = 1.0    # longest time (sec) to wait for pending writes on closing (see flush_writes)
+snapshotBudget = 1.0 # longest time (sec) to read the device at startup (see snapshot_dev_state)
+
+priorityWrite   = 0  # priorities of device access (see ioWorker): user writes,
+priorityChange  = 1  # reads to detect changes,
+priorityRefresh = 2  # and background refresh.
+
+pollPeriod = {"hardware":0.1,  # interval (sec) of polling, per volatility tier of registers
+              "rare":1.0,      # (see HWdata["pollTier"] and pollSchedule)
+              "software":10.0} # "hardware" is the initial one, adapted to activity:
+pollInterval_Range = {"Min":0.05, "Max":1.6} # right after a change, and ceiling when idle
+notifyTimeout = 500  # timeout (msec) of a read of notification endpoint (see notifyListener)
+notifyRecent = 3     # notifications are trusted while the last one is within this many ceilings
+                     # of polling interval (pollInterval_Range["Max"]) old
+stateCacheDir = os.path.join(os.environ.get("XDG_CACHE_HOME",
+                                            os.path.join(os.path.expanduser("~"), ".cache")),
+                             "manestrone") # last known register values (see save_dev_state)
+recordFile = os.environ.get("MANESTRONE_RECORD") # if set, every control transfer of the device
+                                                # bound is recorded there (see ManestroneRecord.py)
+daemonSocket = os.path.join(os.environ.get("XDG_RUNTIME_DIR", "/tmp"),
+                            "manestrone-%d.sock" % os.getuid()) # see ManestroneDaemon.py
+
+#
+# global variable
+#
+# vendor ID, product ID, product name, number of input, output.
+
+Quartet = {}                           # dict of device(Quartet) info 
+Quartet["VendorID"] = 0x0c60
+Quartet["ProductID"] = 0x0014
+Quartet["ProductName"] = "Apogee Quartet"
+
+Quartet["InputNum"] = 4
+Quartet["softLimit_Request"]  = 17
+Quartet["phase_Request"]      = 19
+Quartet["phantom_Request"]    = 21
+Quartet["inputType_Request"]  = 22
+Quartet["micLevel_Request"]   = 52
+Quartet["instLevel_Request"]  = 62
+Quartet["inputGroup_Request"] = 68
+Quartet["inputType"]        = ["Line  +4dB", "Line -10dB", "Microphone", "Instrument"]
+Quartet["micLevel_Range"]   = {"Min":0, "Max":75}
+Quartet["instLevel_Range"]  = {"Min":0, "Max":65}
+Quartet["inputGroupChoice"] = ["Group OFF", "Group 1", "Group2 "]
+
+Quartet["outputLevel_Request"]     =  51
+Quartet["outputMute_Request"]      =  53
+Quartet["outputDim_Request"]       =  64
+Quartet["outputConfig_Request"]    =  69
+Quartet["outputMono_Request"]      =  70
+Quartet["output_Line_Request"]     =  71
+Quartet["outputSource_Request"]    =  83
+Quartet["outputLineLevel_Request"] = 182
+Quartet["output_Speaker_Index"]   = 0
+Quartet["output_Headphone_Index"] = 1
+Quartet["outputConfigChoice"]    = ["Line", "Stereo", "2 Speaker Sets", "3 Speaker Sets", "5.1"]
+Quartet["output_LineNameChoice"] = ["Line 1/2", "Line 3/4", "Line 5/6"] 
+Quartet["line_Name"]             = ["Line 1/2", "Headphone", "Line 5/6", "Line 3/4"]
+Quartet["output_Line_Index"]     = [0, 3, 2]
+Quartet["output_SpSelectIndex"]  = [1, 2, 4]
+Quartet["output_SpChoiceToIndex"] = {0:0, 1:0, 2:1, 4:2} # key 0 is for offline use.
+Quartet["outputSource_Dest"]     = [0 ,3, 2, 1] # line1/2:index0, headphone:index3,
+                                                # line 5/6:index2, line3/4:index1
+Quartet["outputSourceChoice"]    = ["Output 1/2",
+                                    "Output 3/4",
+                                    "Output 5/6",
+                                    "Output 7/8",
+                                    "Mixer    1",
+                                    "Mixer    2"] 
+Quartet["outputLineLevelChoice"] = ["+ 4dBV", "-10dBV"]
+Quartet["outputLevel_Range"]     = {"Min":-64, "Max":0}
+
+Quartet["mixer_Num"]           =  2 # wValue = 0, 1
+Quartet["mixerChannel_Num"]    = 12 # number of input channels. actually quartet has 12(index 0-11,
+                                  # (4 analog, 8 digital)
+Quartet["mixerChannel_SWR"]    = 12 # software return channel
+Quartet["mixerChannel_Master"] = 13  # master output channel
+Quartet["mixerHWset_Request"]   = 16
+Quartet["mixerSoftRtn_Request"] = 54 # software return source
+Quartet["mixerLevel_Request"]   = 76
+Quartet["mixerPan_Request"]     = 77
+Quartet["mixerSolo_Request"]    = 78
+Quartet["mixerMute_Request"]    = 79
+Quartet["mixerSoftRtnChoice"] = ["Playback 1/2", "Playback 3/4",  "Playback 5/6",  "Playback 7/8"]
+Quartet["mixerLevel_Range"]   = {"Min":-48, "Max":6}
+Quartet["mixerPan_Range"]     = {"Min":-64, "Max":64}
+
+# volatility tier of registers, for polling (see pollPeriod)
+#  hardware: can be changed on the device (front panel knob and buttons)
+#  rare    : can be changed only by software, but not often
+#  software: mixer settings. cannot be changed by HW, only by other software.
+Quartet["pollTier"] = {"outputLevel_Request":"hardware",
+                       "outputMute_Request":"hardware",
+                       "micLevel_Request":"hardware",
+                       "instLevel_Request":"hardware",
+                       "mixerSoftRtn_Request":"software",
+                       "mixerLevel_Request":"software",
+                       "mixerPan_Request":"software",
+                       "mixerSolo_Request":"software",
+                       "mixerMute_Request":"software"} # others are "rare"
+
+ApogeeDevices = [Quartet]     # list of supported devices (currently only Quartet)
+
+dev = None                    # hardware device found. None when offline.
+HWdata = None                 # dict of info for identified device
+HWmixer = None                # mixerEngine for identified device
+HWio = None                   # ioWorker for identified device. every transfer goes through it.
+HWnotify = None               # notifyListener for identified device
+
+HWregs = {}                   # shadow register file: (request, wValue, wIndex) -> value.
+                              # refreshed from hardware only by poll_dev_state (or on first access),
+                              # set_dev_value writes through.
+HWchanged = set()             # registers changed since last take_changes (by polling or writes)
+HWchangedLock = threading.Lock()  # also for HWwrites, and for HWregs updated by set/poll
+HWwrites = {}                 # number of writes by set_dev_value: (request, wValue, wIndex) -> count.
+                              # a poll whose read overlapped a write is dropped (see poll_dev_state)
+HWmixerSent = {}              # last message sent to mixer: wIndex (mixer * 2 + left 0/right 1) -> bytes
+HWmixerPayload = {}           # message of each mixer index, shared by every view (see push_mixer).
+                              # dropped when polling finds a mixer register changed elsewhere.
+HWmixerLock = threading.Lock()    # for HWmixerPayload
+HWmixerDeferred = set()       # mixer indices whose message could not be sent yet (see push_mixer)
+HWseeded = set()              # registers filled with 0, not read from the device yet (see seed_dev_state)
+HWstats = {"reads":0,          # number of control transfers to read
+           "writes":0,         # and to write
+           "mixerSuppressed":0, # number of mixerHWset transfers skipped as payload did not change
+           "errors":0,         # number of device accesses failed
+           "writeErrors":0}    # of which writes
+HWlastError = None            # last failure reported (see report_error)
+
+def report_error(what, e): # prints failure of device access, but not the same error again and again
+    global HWlastError
+    HWstats["errors"] += 1
+    if str(e) != HWlastError:
+        print(what + ": " + str(e))
+    HWlastError = str(e)
+
+def find_device():
+    dev = None
+    for apogeeinfo in ApogeeDevices:
+        dev = usb.core.find(idVendor = apogeeinfo["VendorID"],
+                            idProduct = apogeeinfo["ProductID"])
+        if (dev != None):
+            return [dev, apogeeinfo]
+
+    return None
+
+def bind_device(device, hwdata): # device is None for offline use
+    global dev, HWdata, HWmixer, HWio, HWnotify
+    if HWnotify is not None:
+        HWnotify.stop()
+        HWnotify = None
+    if recordFile and device is not None:
+        import ManestroneRecord
+        device = ManestroneRecord.transferRecorder(device, recordFile)
+    dev = device
+    HWdata = hwdata
+    HWregs.clear()
+    HWwrites.clear()
+    HWmixerSent.clear()
+    HWmixerPayload.clear()
+    HWmixerDeferred.clear()
+    HWseeded.clear()
+    HWmixer = mixerEngine(HWdata) # gain/pan tables are built here, once.
+    if HWio is None:
+        HWio = ioWorker()
+    if dev is not None:
+        HWnotify = notifyListener(dev)
+
+def flush_writes(): # sends pending writes now (waiting flushBudget at most). call before closing.
+                    # returns False if they could not be sent in time.
+    if HWio is not None and dev is not None:
+        try:
+            HWio.flush(flushBudget)
+        except TimeoutError:
+            print("device did not take pending writes in %.1f sec" % flushBudget)
+            return False
+    return True
+
+def read_dev_value(request, wValue = 0, wIndex = 0, priority = priorityChange,
+                   timeout = None): # actual read from hardware. waits "timeout" sec at most
+    def read(): # on I/O thread
+        HWstats["reads"] += 1
+        return dev.ctrl_transfer(0xc0, HWdata[request], wValue, wIndex, 1, transferTimeout)[0]
+    return HWio.call(read, priority, timeout)
+
+def get_dev_value(request, wValue = 0, wIndex = 0, strict = False):
+    # value of register, read from hardware if not polled yet.
+    # if it cannot be read, 0 is returned (shown until polling reads it). with "strict",
+    # the error is raised instead: for values sent to hardware (e.g. mixer_state), 0 is not safe.
+    # a register only seeded (see seed_dev_state) is not read yet, so "strict" raises LookupError.
+    key = (request, wValue, wIndex)
+    if strict and key in HWseeded:
+        raise LookupError(str(key) + " has not been read from the device yet")
+    if key not in HWregs: # not polled yet
+        try:
+            HWregs[key] = read_dev_value(request, wValue, wIndex, timeout = callBudget)
+        except Exception as e:
+            if strict:
+                raise
+            report_error("could not read " + str(key), e)
+            return 0
+    return HWregs[key]
+
+def write_dev_value(request, wValue, wIndex, data): # actual write to hardware, on I/O thread
+    if request == "mixerHWset_Request":
+        # a side whose message is the same as the last one sent is not sent again.
+        if HWmixerSent.get(wIndex) == data:
+            HWstats["mixerSuppressed"] += 1
+            return
+        HWstats["writes"] += 1
+        dev.ctrl_transfer(0x40, HWdata[request], wValue, wIndex, data, transferTimeout)
+        HWmixerSent[wIndex] = data
+    else:
+        HWstats["writes"] += 1
+        dev.ctrl_transfer(0x40, HWdata[request], wValue, wIndex, data, transferTimeout)
+
+def set_dev_value(request, wValue = 0, wIndex =0, msg = None):
+    if dev is not None:
+        key = (request, wValue, wIndex)
+        with HWchangedLock: # queued under the lock, so a poll sees the write pending
+                            # (HWio.writing) as soon as it sees the count bumped
+            HWregs[key] = msg
+            HWseeded.discard(key)
+            HWwrites[key] = HWwrites.get(key, 0) + 1
+            HWchanged.add(key)
+            HWio.put(request, wValue, wIndex, [msg])
+
+def push_mixer(mixerindex, channel = None):
+    # sends message of mixer, calculated from the register file (which set_dev_value updates
+    # at once), so every view of the same mixer sends the same message.
+    # "channel" is the channel whose level, pan or mute changed: only that channel is
+    # recomputed in the message kept for the mixer. None means every channel (solo or master
+    # change). returns False (nothing sent) if a register of the mixer cannot be read, or has
+    # not been read yet: then it is sent by push_deferred_mixers, after polling has read it.
+    with HWmixerLock:
+        try:
+            state = mixer_state(mixerindex)
+        except Exception as e:
+            report_error("mixer %d was not sent" % (mixerindex + 1), e)
+            HWmixerDeferred.add(mixerindex)
+            return False
+        HWmixerDeferred.discard(mixerindex)
+        payload = HWmixerPayload.get(mixerindex)
+        if channel is None or channel == HWdata["mixerChannel_Master"] or payload is None:
+            payload = HWmixer.payload(state)
+            HWmixerPayload[mixerindex] = payload
+        else:
+            HWmixer.set_channel(payload, state, channel)
+        set_mixer_payload(mixerindex, payload)
+    return True
+
+def push_deferred_mixers(): # sends messages push_mixer could not send (called after polling)
+    for mixerindex in sorted(HWmixerDeferred):
+        push_mixer(mixerindex)
+
+def set_mixer_payload(mixerindex, payload): # sends message calculated by mixerEngine.
+                                            # mixer setting registers do not affect hardware
+                                            # behavior, this does.
+    if dev is not None:
+        HWio.put("mixerHWset_Request", 0, mixerindex * 2,     bytes(payload["left"]))
+        HWio.put("mixerHWset_Request", 0, mixerindex * 2 + 1, bytes(payload["right"]))
+
+mixerRequests = ["mixerLevel_Request", "mixerPan_Request", "mixerSolo_Request", "mixerMute_Request"]
+switchRequests = ["softLimit_Request", "phase_Request", "phantom_Request", "outputMute_Request",
+                  "outputDim_Request", "outputMono_Request", "mixerSolo_Request", "mixerMute_Request"]
+choiceRequests = {"inputType_Request":"inputType",          # request -> its choices in HWdata
+                  "inputGroup_Request":"inputGroupChoice",
+                  "outputConfig_Request":"outputConfigChoice",
+                  "outputSource_Request":"outputSourceChoice",
+                  "outputLineLevel_Request":"outputLineLevelChoice",
+                  "mixerSoftRtn_Request":"mixerSoftRtnChoice"}
+
+def dev_values(request): # register values a register of "request" can take, from the device profile
+    if request in switchRequests:
+        return range(0, 2)
+    if request in choiceRequests:
+        return range(0, len(HWdata[choiceRequests[request]]))
+    if request in ["micLevel_Request", "instLevel_Request"]: # register is the level
+        levelRange = HWdata[request.replace("_Request", "_Range")]
+        return range(levelRange["Min"], levelRange["Max"] + 1)
+    if request in ["outputLevel_Request", "mixerLevel_Request", "mixerPan_Request"]: # from 0
+        levelRange = HWdata[request.replace("_Request", "_Range")]
+        return range(0, levelRange["Max"] - levelRange["Min"] + 1)
+    if request == "output_Line_Request":
+        return sorted(HWdata["output_SpChoiceToIndex"])
+    return range(0, 0x100)
+
+def check_dev_register(key): # raises ValueError unless "key" is [request, wValue, wIndex]
+                              # of a register which can be read and set
+    if not isinstance(key, (list, tuple)) or len(key) != 3:
+        raise ValueError("not [request, wValue, wIndex]: " + repr(key))
+    request, wValue, wIndex = key
+    if (not isinstance(request, str) or not request.endswith("_Request")
+        or request not in HWdata or request == "mixerHWset_Request"):
+        raise ValueError("unknown request: " + repr(request))
+    for name, number in [("wValue", wValue), ("wIndex", wIndex)]:
+        if type(number) is not int or number < 0 or number > 0xffff:
+            raise ValueError("%s of %s must be an integer 0 - 65535: %r" % (name, request, number))
+    if request in mixerRequests and (request, wValue, wIndex) not in dev_registers():
+        raise ValueError("no such mixer register: " + repr((request, wValue, wIndex)))
+
+def check_dev_value(item): # raises ValueError unless "item" is [request, wValue, wIndex, value]
+                           # which can be set by set_dev_value
+    if not isinstance(item, (list, tuple)) or len(item) != 4:
+        raise ValueError("not [request, wValue, wIndex, value]: " + repr(item))
+    request, wValue, wIndex, value = item
+    check_dev_register(item[:3])
+    values = dev_values(request)
+    if type(value) is not int or value not in values:
+        if isinstance(values, range):
+            allowed = "an integer %d - %d" % (values[0], values[-1])
+        else:
+            allowed = "one of " + ", ".join([str(each) for each in values])
+        raise ValueError("value of %s must be %s: %r" % (request, allowed, value))
+
+def set_dev_values(values): # sets many registers at once: list of (request, wValue, wIndex, value).
+                            # every one is checked first, and nothing is set if one is wrong.
+                            # mixer setting registers (wValue is mixer index) are pushed to
+                            # hardware by one mixerHWset message per mixer, after all are set.
+    for item in values:
+        check_dev_value(item)
+    batch = {}
+    for request, wValue, wIndex, value in values:
+        batch[(request, wValue, wIndex)] = value
+    mixers = sorted(set([key[1] for key in batch if key[0] in mixerRequests]))
+    with HWmixerLock:
+        # messages are calculated before anything is set, so a batch which fails sets nothing
+        payloads = HWmixer.payloads([mixer_state(mixerindex, batch) for mixerindex in mixers])
+        for request, wValue, wIndex, value in values:
+            set_dev_value(request, wValue, wIndex, value)
+        for mixerindex, payload in zip(mixers, payloads):
+            HWmixerPayload[mixerindex] = payload
+            set_mixer_payload(mixerindex, payload)
+    return mixers
+
+class ioWorker:
+    # the only thread which talks to the device, so transfers never interleave.
+    # jobs are served in order of priority: user writes first, then reads to detect changes,
+    # then background refresh, so a user gesture never waits behind a full poll.
+    # writes are coalesced: only the latest message per (request, wValue, wIndex) is kept,
+    # and pending messages are sent at most writeRate times per second,
+    # so dragging a slider does not flood the device with intermediate values.
+
+    def __init__(self, rate = None):
+        if rate is None:
+            rate = writeRate
+        self.interval = 1 / rate
+        self.pending = {}                 # (request, wValue, wIndex) -> data, in order of first put
+        self.sending = {}                 # messages being sent
+        self.jobs = []                    # heap of (priority, sequence, job)
+        self.sequence = 0
+        self.nextWrite = 0                # time when pending messages may be sent
+        self.cond = threading.Condition() # for all of above
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    def put(self, request, wValue, wIndex, data): # queues a write
+        with self.cond:
+            self.pending[(request, wValue, wIndex)] = data
+            self.cond.notify()
+
+    def writing(self, key): # True if a write of the register is pending or being sent
+        return key in self.pending or key in self.sending
+
+    def call(self, func, priority = priorityChange, timeout = None):
+        # runs func on I/O thread, and returns its result.
+        # raises TimeoutError if it is not done in "timeout" sec (None: waits until done).
+        if threading.current_thread() is self.thread:
+            return func()
+        job = {"func":func, "done":threading.Event(), "result":None, "error":None,
+               "cancelled":False}
+        with self.cond:
+            heapq.heappush(self.jobs, (priority, self.sequence, job))
+            self.sequence += 1
+            self.cond.notify()
+        if not job["done"].wait(timeout):
+            with self.cond:
+                job["cancelled"] = True # not run, if not started yet
+            raise TimeoutError("device did not answer in %.2f sec" % timeout)
+        if job["error"] is not None:
+            raise job["error"]
+        return job["result"]
+
+    def flush(self, timeout = None): # sends pending writes now, regardless of writeRate
+        self.call(self.send_writes, priorityWrite, timeout)
+
+    def send_writes(self):
+        with self.cond:
+            self.sending = self.pending
+            self.pending = {}
+        for key, data in self.sending.items():
+            try:
+                write_dev_value(*key, data)
+            except Exception as e: # keep the worker alive. the value is shown again by polling.
+                HWstats["writeErrors"] += 1
+                report_error("write of " + str(key) + " failed", e)
+        self.sending = {}
+        self.nextWrite = time.monotonic() + self.interval
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    now = time.monotonic()
+                    if self.pending and now >= self.nextWrite:
+                        job = None
+                        break
+                    if self.jobs:
+                        job = heapq.heappop(self.jobs)[2]
+                        if job["cancelled"]: # caller has given up
+                            continue
+                        break
+                    if self.pending:
+                        self.cond.wait(self.nextWrite - now)
+                    else:
+                        self.cond.wait()
+
+            if job is None:
+                self.send_writes()
+                continue
+            try:
+                job["result"] = job["func"]()
+            except Exception as e:
+                job["error"] = e
+            job["done"].set()
+
+def dev_registers(): # list of (request, wValue, wIndex) of every value displayed
+    regs = []
+    for index in range(0, HWdata["InputNum"]):
+        for request in ["inputType_Request", "softLimit_Request", "phantom_Request",
+                        "micLevel_Request", "instLevel_Request", "inputGroup_Request"]:
+            regs.append((request, 0, index))
+
+    for index in [HWdata["output_Speaker_Index"], HWdata["output_Headphone_Index"]]:
+        for request in ["outputLevel_Request", "outputMute_Request",
+                        "outputDim_Request", "outputMono_Request"]:
+            regs.append((request, 0, index))
+    regs.append(("output_Line_Request", 0, HWdata["output_Speaker_Index"]))
+    regs.append(("outputConfig_Request", 0, HWdata["output_Speaker_Index"]))
+    for dest in sorted(set(HWdata["outputSource_Dest"])):
+        regs.append(("outputSource_Request", 0, dest))
+    for index in HWdata["output_Line_Index"]:
+        lineIndex = HWdata["outputSource_Dest"][index] * 2
+        regs.append(("outputLineLevel_Request", 0, lineIndex))
+        regs.append(("outputLineLevel_Request", 0, lineIndex + 1))
+
+    for mixerindex in range(0, HWdata["mixer_Num"]):
+        regs.append(("mixerSoftRtn_Request", 0, mixerindex))
+        for channel in range(0, HWdata["mixerChannel_Master"] + 1):
+            regs.append(("mixerLevel_Request", mixerindex, channel))
+            if (channel < HWdata["mixerChannel_Num"]):
+                regs.append(("mixerPan_Request", mixerindex, channel))
+            if (channel != HWdata["mixerChannel_Master"]):
+                regs.append(("mixerSolo_Request", mixerindex, channel))
+                regs.append(("mixerMute_Request", mixerindex, channel))
+    return regs
+
+def poll_dev_state(priority = priorityRefresh, keys = None, deadline = None):
+    # refreshes the register file from hardware, reading every register (or "keys") once,
+    # so the number of transfers per tick does not depend on number of views.
+    # returns list of registers whose value changed.
+    # a register which failed to be read is skipped (read again next time). raises the error
+    # if every read failed, or device is gone.
+    # with "deadline" (time.monotonic()), raises TimeoutError when it has passed, or at the
+    # first timeout of a transfer.
+    changed = []
+    error = None
+    done = 0
+    if dev is None:
+        return changed
+    if keys is None:
+        keys = dev_registers()
+    try:
+        for key in keys:
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError("device was not read in time")
+            written = HWwrites.get(key, 0)
+            if HWio.writing(key): # hardware has not got the new value yet
+                continue
+            try:
+                if poll_tier(key) == "hardware":
+                    value = read_dev_value(*key, min(priority, priorityChange))
+                else:
+                    value = read_dev_value(*key, priority)
+            except Exception as e:
+                if is_gone(e) or (deadline is not None and is_timeout(e)):
+                    raise
+                report_error("could not read " + str(key), e)
+                error = e
+                continue
+            done += 1
+            with HWchangedLock:
+                if HWwrites.get(key, 0) != written or HWio.writing(key):
+                    continue # written while being read: the value read may be the old one
+                HWseeded.discard(key)
+                if HWregs.get(key) != value:
+                    HWregs[key] = value
+                    changed.append(key)
+                    if key[0] in mixerRequests: # changed elsewhere: recompute whole message
+                        HWmixerPayload.pop(key[1], None)
+    finally: # changes found so far are kept, even if polling stopped
+        with HWchangedLock:
+            HWchanged.update(changed)
+    if error is not None and done == 0:
+        raise error
+    return changed
+
+def poll_tier(key): # volatility tier of register (see pollPeriod)
+    return HWdata["pollTier"].get(key[0], "rare")
+
+class pollSchedule:
+    # tells which registers should be polled now: each volatility tier is polled at
+    # its own period (pollPeriod), so steady state poll is only a handful of transfers.
+    # "hardware" tier is polled every time, and the interval adapts to activity:
+    # tightened right after a change on the device, and doubled up to the ceiling
+    # while nothing changes (see next_interval).
+
+    def __init__(self):
+        self.last = {} # tier -> time of last poll
+        self.interval = pollPeriod["hardware"]
+
+    def next_interval(self, changed): # wait until next poll, after a poll with "changed" registers
+        if HWnotify is not None and HWnotify.active():
+            # the device tells its changes (see notifyListener). polling is only a safety net.
+            self.interval = pollInterval_Range["Max"]
+        elif changed:
+            self.interval = pollInterval_Range["Min"]
+        else:
+            self.interval = min(self.interval * 2, pollInterval_Range["Max"])
+        return self.interval
+
+    def due(self, keys = None, now = None): # registers of "keys" (None: every register) due now
+        if keys is None:
+            keys = dev_registers()
+        if now is None:
+            now = time.monotonic()
+        tiers = []
+        for tier, period in pollPeriod.items():
+            if (tier == "hardware" or tier not in self.last
+                or now - self.last[tier] >= period - 0.001):
+                tiers.append(tier)
+                self.last[tier] = now
+        due = [key for key in keys if poll_tier(key) in tiers]
+        if HWnotify is not None:
+            due += [key for key in HWnotify.take_invalid() if key not in due]
+        return due
+
+class pollThread:
+    # polls the device periodically (see pollSchedule), and calls callback(changed) once per tick
+    # with registers changed by polling or by writes. callback runs on this thread.
+
+    def __init__(self, callback, reconcile = False, interval = None):
+        self.callback = callback
+        self.reconcile = reconcile # if True, every register is read first (see load_dev_state)
+        self.interval = interval   # first interval. None: pollPeriod["hardware"]
+        self.keys = None           # registers to poll. None: every register
+        self.schedule = pollSchedule()
+        self.ticks = 0             # number of ticks done
+        self.errors = 0            # number of ticks failed
+        self.failures = 0          # number of ticks failed in a row
+        self.error = None          # message of last failure, None while polling works
+        self.stopped = threading.Event()
+        self.awake = threading.Event() # cleared while suspended
+        self.awake.set()
+        self.wake = threading.Event()  # wakes up polling before interval
+        if HWnotify is not None:
+            HWnotify.callback = self.wake.set
+        self.thread = threading.Thread(target = self.run)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        self.awake.set()
+        self.wake.set()
+
+    def suspend(self):
+        self.awake.clear()
+
+    def resume(self):
+        self.awake.set()
+
+    def tick(self, notified = False): # one round of polling. returns interval to next one.
+                                      # "notified": woken by a device notification before the
+                                      # scheduled tick. only the registers it told are read,
+                                      # and None is returned (the schedule is kept).
+        if self.reconcile: # register file has saved state. read the device now.
+            snapshot = snapshot_dev_state()
+            self.reconcile = False
+            print("device state reconciled: %d registers read in %.1f ms"
+                  % (snapshot[0], snapshot[1] * 1000))
+            interval = self.interval
+        elif notified and HWnotify is not None:
+            poll_dev_state(keys = sorted(HWnotify.take_invalid()))
+            interval = None
+        else:
+            polled = poll_dev_state(keys = self.schedule.due(self.keys))
+            interval = self.schedule.next_interval(polled)
+        if HWmixerDeferred:
+            push_deferred_mixers()
+        changed = take_changes() # by polling, and by writes
+        if changed:
+            self.callback(changed)
+        self.ticks += 1
+        return interval
+
+    def run(self):
+        # an exception (e.g. USB error of a flaky hub, or device unplugged) fails only its tick.
+        # polling is retried at intervals doubled on each failure (up to the longest one),
+        # until it works again.
+        # notifications wake it up at most once per pollInterval_Range["Min"], so a chatty
+        # notification endpoint does not turn into a flood of control transfers.
+        if self.interval is None:
+            self.interval = pollPeriod["hardware"]
+        interval = self.interval
+        if self.reconcile:
+            interval = 0
+        due = time.monotonic() + interval # time of next scheduled tick
+        last = None                       # time of last tick
+        while True:
+            self.wake.wait(timeout = max(0, due - time.monotonic())) # set by device notification,
+            self.wake.clear()                                        # or on stop
+            if self.stopped.is_set():
+                break
+            self.awake.wait()
+            if self.stopped.is_set():
+                break
+            if last is not None and time.monotonic() - last < pollInterval_Range["Min"]:
+                self.stopped.wait(pollInterval_Range["Min"] - (time.monotonic() - last))
+                if self.stopped.is_set():
+                    break
+            last = time.monotonic()
+            try:
+                interval = self.tick(notified = last < due)
+            except Exception as e:
+                self.errors += 1
+                self.failures += 1
+                if self.error is None:
+                    print("polling failed (" + str(e) + "). retrying")
+                self.error = str(e)
+                due = time.monotonic() + min(pollInterval_Range["Max"],
+                                             self.interval * 2 ** self.failures)
+                continue
+            if interval is not None:
+                due = time.monotonic() + interval
+            self.failures = 0
+            if self.error is not None:
+                print("polling works again")
+                self.error = None
+
+def find_notify_endpoint(device): # address of interrupt IN endpoint of device, or None
+    try:
+        for interface in device.get_active_configuration():
+            for endpoint in interface:
+                if ((endpoint.bmAttributes & 0x03) == 0x03              # interrupt
+                    and (endpoint.bEndpointAddress & 0x80) == 0x80):    # IN
+                    return endpoint.bEndpointAddress
+    except Exception:
+        pass
+    return None
+
+def is_gone(e): # True if exception "e" tells the device is not connected any more
+    return getattr(e, "errno", None) == 19 # ENODEV
+
+def is_timeout(e): # True if exception "e" is timeout of a USB transfer
+    return (isinstance(e, TimeoutError) or type(e).__name__ == "USBTimeoutError"
+            or getattr(e, "errno", None) == 110) # ETIMEDOUT
+
+class notifyListener:
+    # reads change notifications from interrupt IN endpoint of the device (if any), and
+    # invalidates affected registers, so they are polled at once (see pollSchedule.due).
+    # interrupt transfers go to their own endpoint, so they are read here, not by ioWorker.
+    # notification is expected as [request code, wValue, wIndex, ...]. anything else tells
+    # nothing (e.g. meters or status), and is ignored. while no notification has arrived recently,
+    # polling goes on as before. a failed read is retried (with backoff), so notifications
+    # resume when the device comes back.
+
+    def __init__(self, device, callback = None):
+        self.device = device
+        self.callback = callback # called after a notification (e.g. to wake up polling)
+        self.lastNotify = None   # time of last notification
+        self.invalid = set()
+        self.lock = threading.Lock() # for self.invalid
+        self.stopped = threading.Event()
+        self.endpoint = find_notify_endpoint(device)
+        if self.endpoint is not None:
+            self.thread = threading.Thread(target = self.run, daemon = True)
+            self.thread.start()
+
+    def active(self): # True if the device has been sending notifications recently
+        lastNotify = self.lastNotify
+        return (self.endpoint is not None and lastNotify is not None
+                and time.monotonic() - lastNotify < notifyRecent * pollInterval_Range["Max"])
+
+    def stop(self):
+        self.stopped.set()
+
+    def take_invalid(self): # registers invalidated since last call
+        with self.lock:
+            invalid = self.invalid
+            self.invalid = set()
+        return invalid
+
+    def decode(self, data): # registers affected by notification "data" (empty if it tells nothing)
+        requests = {}
+        for name, value in HWdata.items():
+            if name.endswith("_Request"):
+                requests[value] = name
+        if len(data) >= 3 and data[0] in requests:
+            return set([(requests[data[0]], data[1], data[2])])
+        return set()
+
+    def run(self):
+        failures = 0
+        while not self.stopped.is_set():
+            try:
+                data = self.device.read(self.endpoint, 64, notifyTimeout)
+            except Exception as e:
+                if is_timeout(e):
+                    continue
+                if failures == 0:
+                    print("notification endpoint failed (" + str(e) + "). polling only, retrying")
+                failures += 1
+                self.lastNotify = None # poll as before, until notifications arrive again
+                self.stopped.wait(min(pollInterval_Range["Max"],
+                                      pollInterval_Range["Min"] * 2 ** failures))
+                continue
+            if failures:
+                print("notification endpoint works again")
+                failures = 0
+            invalid = self.decode(data)
+            if not invalid:
+                continue
+            with self.lock:
+                self.invalid |= invalid
+            self.lastNotify = time.monotonic()
+            if self.callback is not None:
+                self.callback()
+
+def snapshot_dev_state(timeout = None):
+    # reads every register exactly once, to fill the register file when device is bound.
+    # returns (number of transfers, seconds). with "timeout" (sec), gives up (raising TimeoutError)
+    # when it is spent, or at the first timeout of a transfer: see seed_dev_state.
+    count = HWstats["reads"]
+    start = time.perf_counter()
+    deadline = None
+    if timeout is not None:
+        deadline = time.monotonic() + timeout
+    poll_dev_state(priorityChange, deadline = deadline)
+    return (HWstats["reads"] - count, time.perf_counter() - start)
+
+def seed_dev_state(): # fills registers not read yet with 0, so views can be built without waiting
+                      # for the device. they must be read later (pollThread with reconcile).
+                      # until then they are in HWseeded: not sent to mixers (see push_mixer),
+                      # nor saved.
+    with HWchangedLock:
+        for key in dev_registers():
+            if key not in HWregs:
+                HWregs[key] = 0
+                HWseeded.add(key)
+
+def state_cache_path(): # file of last known register values of the device, by serial number
+    try:
+        serial = HWio.call(lambda: dev.serial_number, priorityChange, callBudget)
+    except Exception:
+        serial = None
+    if not serial:
+        serial = "unknown"
+    name = HWdata["ProductName"].replace(" ", "_") + "-" + str(serial) + ".json"
+    return os.path.join(stateCacheDir, name)
+
+def save_dev_state(): # saves the register file, so next launch can show it at once
+    if dev is None:
+        return
+    regs = [[key[0], key[1], key[2], value] for key, value in list(HWregs.items())
+            if key not in HWseeded]
+    try:
+        os.makedirs(stateCacheDir, exist_ok = True)
+        with open(state_cache_path(), "w") as f:
+            json.dump(regs, f)
+    except (OSError, ValueError) as e:
+        print("could not save device state: " + str(e))
+
+def load_dev_state(): # fills the register file from the last saved one. False if there is none,
+                      # or it is broken (then nothing is filled).
+                      # values may be out of date: read the device afterwards (snapshot_dev_state).
+    if dev is None:
+        return False
+    try:
+        with open(state_cache_path()) as f:
+            regs = json.load(f)
+        if not isinstance(regs, list):
+            raise ValueError("not a list of registers")
+        for item in regs:
+            check_dev_value(item)
+    except (OSError, ValueError) as e:
+        if not isinstance(e, FileNotFoundError):
+            print("ignoring saved device state: " + str(e))
+        return False
+    for request, wValue, wIndex, value in regs:
+        HWregs[(request, wValue, wIndex)] = value
+    return True
+
+def take_changes(): # returns registers changed since last call, and forgets them
+    global HWchanged
+    with HWchangedLock:
+        changed = HWchanged
+        HWchanged = set()
+    return changed
+
+def mixer_state(mixerindex, values = None):
+    # compact state of a mixer (see mixerEngine), from the register file.
+    # "values" ({(request, wValue, wIndex):value}) are taken in place of the register file,
+    # e.g. a batch not set yet. raises if a register cannot be read.
+    def value(request, channel):
+        key = (request, mixerindex, channel)
+        if values is not None and key in values:
+            return values[key]
+        return get_dev_value(*key, strict = True)
+    levelMin = HWdata["mixerLevel_Range"]["Min"]
+    panMin = HWdata["mixerPan_Range"]["Min"]
+    channels = range(0, HWdata["mixerChannel_Num"] + 1) # inputs and software return
+    return {"Level":[value("mixerLevel_Request", i) + levelMin for i in channels],
+            "Pan":[value("mixerPan_Request", i) + panMin
+                   for i in range(0, HWdata["mixerChannel_Num"])],
+            "Solo":[value("mixerSolo_Request", i) for i in channels],
+            "Mute":[value("mixerMute_Request", i) for i in channels],
+            "Master":value("mixerLevel_Request", HWdata["mixerChannel_Master"]) + levelMin}
+
+class mixerEngine:
+    # calculates messages for mixerHWset_Request from compact mixer state.
+    # state is {"Level":[input 0-11, swr] (-48 - +6),
+    #           "Pan":[input 0-11] (-64 - +64),
+    #           "Solo":[input 0-11, swr] (bool),
+    #           "Mute":[input 0-11, swr] (bool),
+    #           "Master":master level (-48 - +6)}
+    # message is {"left":bytearray, "right":bytearray}, each word big endian:
+    #  left : input 0-11 left,  swr, 0
+    #  right: input 0-11 right, 0,   swr
+    # each word is, basically:
+    #  left  = int(8192(=0x2000) * exp(10^0.05, input dB + master dB) * cos(pan(=0-128)/128 * PI()/2))
+    #  right = int(8192(=0x2000) * exp(10^0.05, input dB + master dB) * sin(pan(=0-128)/128 * PI()/2))
+    #  made stepwise of 10^(1/200). swr has no pan.
+
+    def __init__(self, HWdata):
+        self.channelNum = HWdata["mixerChannel_Num"] # also index of swr in state
+        self.levelMin = HWdata["mixerLevel_Range"]["Min"]
+        self.build_tables(HWdata)
+
+    def build_tables(self, HWdata): # panTable[level + master][pan] = (left word, right word)
+                                    # swrTable[level + master] = word
+                                    # both indexed from the minimum value (tableLevelMin, panMin).
+        step = math.pow(10,(1/200)) # 1.01157945
+        db =   math.pow(10,(1/20))  # 1.1220185
+        self.tableLevelMin = HWdata["mixerLevel_Range"]["Min"] * 2
+        levelMax = HWdata["mixerLevel_Range"]["Max"] * 2
+        self.panMin = HWdata["mixerPan_Range"]["Min"]
+        panMax = HWdata["mixerPan_Range"]["Max"]
+        panRange = panMax - self.panMin
+
+        def quantize(oLevel): # make it stepwise of 10^(1/200)
+            if oLevel < 100:
+                return int(oLevel)
+            return int(0x2000 * math.pow(step, round(math.log(oLevel/0x2000, step))))
+
+        self.panTable = []
+        self.swrTable = []
+        for level in range(self.tableLevelMin, levelMax + 1):
+            thruLevel = 0x2000 * math.pow(db, level)
+            words = []
+            for pan in range(self.panMin, panMax + 1):
+                theta = ((pan - self.panMin)/panRange) * math.pi/2
+                words.append((quantize(thruLevel * math.cos(theta)),
+                              quantize(thruLevel * math.sin(theta))))
+            self.panTable.append(words)
+            self.swrTable.append(int(thruLevel))
+
+        if numpy is not None:
+            self.panArray = numpy.array(self.panTable, dtype = numpy.uint16) # [level][pan][left/right]
+            self.swrArray = numpy.array(self.swrTable, dtype = numpy.uint16)
+
+    def muted(self, state, i, soloFlag):
+        # if master level == -48, mute every channel.
+        if state["Master"] == self.levelMin:
+            return True
+        # if some channels have solo flags, mute non-solo channels
+        if soloFlag == True and state["Solo"][i] == False:
+            return True
+        # if the channel has mute flag or its level = -48, mute it even it has solo flag.
+        if state["Mute"][i] == True or state["Level"][i] == self.levelMin:
+            return True
+        return False
+
+    def channel_words(self, state, i, soloFlag): # (left word, right word) of channel i
+        if self.muted(state, i, soloFlag):
+            return (0, 0)
+        level = state["Level"][i] + state["Master"] - self.tableLevelMin
+        if i == self.channelNum: # software return
+            return (self.swrTable[level], self.swrTable[level])
+        return self.panTable[level][state["Pan"][i] - self.panMin]
+
+    def set_channel(self, payload, state, i): # recalculates channel i only, patching payload in place.
+                                              # valid for level, pan or mute change of the channel.
+        soloFlag = True in [each == True for each in state["Solo"]]
+        left, right = self.channel_words(state, i, soloFlag)
+        offset = i * 2
+        if i == self.channelNum:
+            payload["left"][offset:offset + 4] = bytes([left >> 8, left & 0xff, 0, 0])
+            payload["right"][offset:offset + 4] = bytes([0, 0, right >> 8, right & 0xff])
+        else:
+            payload["left"][offset:offset + 2] = bytes([left >> 8, left & 0xff])
+            payload["right"][offset:offset + 2] = bytes([right >> 8, right & 0xff])
+
+    def payload(self, state): # message of one mixer
+        payload = {"left":bytearray((self.channelNum + 2) * 2),
+                   "right":bytearray((self.channelNum + 2) * 2)}
+        for i in range(0, self.channelNum + 1):
+            self.set_channel(payload, state, i)
+        return payload
+
+    def payloads(self, states): # messages of several mixers at once (e.g. both mixers on recall).
+                                # with numpy, calculated for every channel of every mixer in one batch.
+        if numpy is None:
+            return [self.payload(state) for state in states]
+
+        level = numpy.array([state["Level"] for state in states], dtype = numpy.int32)
+        pan = numpy.array([state["Pan"] for state in states], dtype = numpy.int32)
+        solo = numpy.array([state["Solo"] for state in states], dtype = bool)
+        mute = numpy.array([state["Mute"] for state in states], dtype = bool)
+        master = numpy.array([state["Master"] for state in states], dtype = numpy.int32)
+
+        # same rules as muted()
+        muted = ((master == self.levelMin)[:, None] | (solo.any(axis = 1)[:, None] & ~solo)
+                 | mute | (level == self.levelMin))
+        index = level + master[:, None] - self.tableLevelMin
+
+        words = self.panArray[index[:, :self.channelNum], pan - self.panMin]
+        words[muted[:, :self.channelNum]] = 0
+        swr = self.swrArray[index[:, self.channelNum]]
+        swr[muted[:, self.channelNum]] = 0
+        zero = numpy.zeros_like(swr)
+
+        left = numpy.column_stack([words[:, :, 0], swr, zero]).astype(">u2")  # big endian words
+        right = numpy.column_stack([words[:, :, 1], zero, swr]).astype(">u2")
+        return [{"left":bytearray(left[i].tobytes()), "right":bytearray(right[i].tobytes())}
+                for i in range(0, len(states))]
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ManestroneDaemon.py
+#
+# Copyright (C) 2021  SUZUDO Yasushi  <yasushi_suzudo@yahoo.co.jp>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+
+# headless Manestrone. opens the device once, keeps the register file up to date by polling
+# (ManestroneCore.pollThread), and serves it over a unix domain socket (ManestroneCore.daemonSocket),
+# so scripts and front ends share one device handle. wx is not needed.
+#
+#  usage: python3 ManestroneDaemon.py [--sim | --replay recording] [socket path]
+#
+# protocol: one JSON object per line, each answered by one JSON line.
+# a register is [request, wValue, wIndex], with its value [request, wValue, wIndex, value].
+#  {"cmd":"info"}                          -> {"ok":true, "product":..., "registers":[register...]}
+#  {"cmd":"get", "regs":[register...]}     -> {"ok":true, "values":[value...]}  (no "regs": every one)
+#  {"cmd":"set", "values":[value...]}      -> {"ok":true, "mixers":[mixer index pushed...]}
+#  {"cmd":"subscribe"}                     -> {"ok":true}, then {"changed":[value...]} per change
+# on error: {"ok":false, "error":message}
+
+import os
+import sys
+import json
+import queue
+import signal
+import socket
+import threading
+import socketserver
+import ManestroneCore as core
+
+subscribers = []              # queue.Queue of each subscribed connection
+subscribersLock = threading.Lock()
+
+def values_of(keys): # [request, wValue, wIndex, value] of registers, from the register file
+    return [[key[0], key[1], key[2], core.get_dev_value(*key)] for key in keys]
+
+def broadcast(changed): # called by polling thread, once per tick with changes
+    values = values_of(sorted(changed))
+    with subscribersLock:
+        for each in subscribers:
+            each.put(values)
+
+def answer(msg): # answer to a request other than "subscribe"
+    cmd = msg.get("cmd")
+    if cmd == "info":
+        return {"ok":True, "product":core.HWdata["ProductName"],
+                "registers":[list(key) for key in core.dev_registers()]}
+    if cmd == "get":
+        keys = msg.get("regs")
+        if keys is None:
+            keys = core.dev_registers()
+        for key in keys:
+            core.check_dev_register(key)
+        return {"ok":True, "values":values_of([tuple(key) for key in keys])}
+    if cmd == "set":
+        return {"ok":True, "mixers":core.set_dev_values(msg["values"])}
+    raise ValueError("unknown command: " + str(cmd))
+
+class requestHandler(socketserver.StreamRequestHandler):
+
+    def send(self, msg):
+        self.wfile.write((json.dumps(msg) + "\n").encode())
+        self.wfile.flush()
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                msg = json.loads(line)
+                if not isinstance(msg, dict):
+                    raise ValueError("not a JSON object: " + line.decode().strip())
+                if msg.get("cmd") == "subscribe":
+                    self.send({"ok":True})
+                    self.subscribe()
+                    return
+                reply = answer(msg)
+            except (ValueError, LookupError, TypeError, OSError) as e: # OSError: device failed
+                reply = {"ok":False, "error":"%s: %s" % (type(e).__name__, e)}
+            self.send(reply)
+
+    def subscribe(self): # streams changes until the client goes away, or the daemon stops
+        changes = queue.Queue()
+        with subscribersLock:
+            subscribers.append(changes)
+        try:
+            while True:
+                values = changes.get()
+                if values is None:
+                    break
+                self.send({"changed":values})
+        except OSError: # client has gone
+            pass
+        finally:
+            with subscribersLock:
+                subscribers.remove(changes)
+
+class daemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def request(msg, path = None): # client side: sends one request to the daemon, returns its answer.
+                               # raises OSError if no daemon is running.
+    if path is None:
+        path = core.daemonSocket
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+        s.connect(path)
+        f = s.makefile("rwb")
+        f.write((json.dumps(msg) + "\n").encode())
+        f.flush()
+        return json.loads(f.readline())
+
+def main(args):
+    path = core.daemonSocket
+    sim = "--sim" in args
+    if sim:
+        args.remove("--sim")
+    replay = None
+    if "--replay" in args: # see ManestroneRecord.py
+        i = args.index("--replay")
+        replay = args[i + 1]
+        del args[i:i + 2]
+    if args:
+        path = args[0]
+    if os.path.exists(path): # left by a daemon which did not stop cleanly?
+        try:                 # (checked before the device is touched)
+            request({"cmd":"info"}, path)
+            print("daemon is already running at " + path)
+            return 1
+        except OSError:
+            os.remove(path)
+
+    if sim:
+        import ManestroneSim
+        found = [ManestroneSim.quartetSim(), core.Quartet]
+    elif replay is not None:
+        import ManestroneRecord
+        found = [ManestroneRecord.replayDevice(replay), core.Quartet]
+    else:
+        found = core.find_device()
+    if found is None:
+        print("No Apogee device found!")
+        return 1
+
+    core.bind_device(found[0], found[1])
+    print(found[1]["ProductName"] + " found!")
+    reconcile = core.load_dev_state()
+    if not reconcile:
+        try:
+            core.snapshot_dev_state(core.snapshotBudget)
+        except Exception as e: # polling reads again
+            print("could not read the device: " + str(e))
+            core.seed_dev_state()
+            reconcile = True
+    core.take_changes()
+
+    server = daemonServer(path, requestHandler)
+    os.chmod(path, 0o600)
+    poller = core.pollThread(broadcast, reconcile)
+    poller.start()
+
+    def stop(signum, frame):
+        threading.Thread(target = server.shutdown).start()
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+    print("serving at " + path)
+    try:
+        server.serve_forever()
+    finally:
+        poller.stop()
+        with subscribersLock:
+            for each in subscribers:
+                each.put(None)
+        server.server_close()
+        os.remove(path)
+        core.flush_writes()
+        core.save_dev_state()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
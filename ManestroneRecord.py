@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ManestroneRecord.py
+#
+# Copyright (C) 2021  SUZUDO Yasushi  <yasushi_suzudo@yahoo.co.jp>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+
+# recorder of USB control transfers, and replay of the recording as a device.
+# transferRecorder wraps a device (pyusb, or ManestroneSim) and writes every ctrl_transfer into
+# a ring file of fixed size records: the latest "capacity" transfers are kept.
+# replayDevice answers control transfers from a recording, so a session captured once on the
+# real device can be used by ManestroneBench.py and ManestroneDaemon.py without hardware.
+# ManestroneCore records every device bound while $MANESTRONE_RECORD names a file.
+#
+#  usage: python3 ManestroneRecord.py file    (prints the recording)
+
+import sys
+import mmap
+import time
+import struct
+import threading
+import ManestroneCore as core
+from ManestroneSim import USBError, USBTimeoutError
+
+magic = b"MNSTREC1"
+header = struct.Struct("<8sIIQd32s") # magic, record size, capacity, records written,
+                                     # start time (epoch), serial number of device
+record = struct.Struct("<dfBBHHHB32s") # time (sec from start), duration (sec), bmRequestType,
+                                       # bRequest, wValue, wIndex, length, status, data
+defaultCapacity = 65536              # records in a ring file (about 3.5 MB)
+statusOK = 0
+statusTimeout = 1
+statusError = 2
+
+class transferRecorder:
+    # acts as the wrapped device. attributes other than ctrl_transfer are those of the device.
+
+    def __init__(self, device, path, capacity = defaultCapacity):
+        self.device = device
+        self.capacity = capacity
+        self.written = 0
+        self.start = time.perf_counter()
+        self.lock = threading.Lock()
+        self.file = open(path, "w+b")
+        self.file.truncate(header.size + capacity * record.size)
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        try:
+            serial = str(device.serial_number or "")
+        except Exception:
+            serial = ""
+        self.head = [magic, record.size, capacity, 0, time.time(), serial.encode()[:32]]
+        header.pack_into(self.map, 0, *self.head)
+
+    def __getattr__(self, name):
+        return getattr(self.device, name)
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue = 0, wIndex = 0,
+                      data_or_wLength = None, timeout = None):
+        start = time.perf_counter()
+        status = statusOK
+        result = None
+        try:
+            result = self.device.ctrl_transfer(bmRequestType, bRequest, wValue, wIndex,
+                                               data_or_wLength, timeout)
+            return result
+        except Exception as e:
+            status = statusTimeout if core.is_timeout(e) else statusError
+            raise
+        finally:
+            if bmRequestType & 0x80: # device to host
+                data = bytes(result) if result is not None else b""
+            else:
+                data = bytes(data_or_wLength)
+            self.put(start, time.perf_counter() - start, bmRequestType, bRequest, wValue, wIndex,
+                     status, data)
+
+    def put(self, start, duration, bmRequestType, bRequest, wValue, wIndex, status, data):
+        with self.lock:
+            record.pack_into(self.map, header.size + (self.written % self.capacity) * record.size,
+                             start - self.start, duration, bmRequestType, bRequest, wValue,
+                             wIndex, len(data), status, data[:32])
+            self.written += 1
+            self.head[3] = self.written
+            header.pack_into(self.map, 0, *self.head)
+
+    def close(self):
+        with self.lock:
+            self.map.flush()
+            self.map.close()
+            self.file.close()
+
+def read_recording(path): # returns (header dict, list of record dicts, oldest first)
+    with open(path, "rb") as f:
+        data = f.read()
+    head = header.unpack_from(data, 0)
+    if head[0] != magic or head[1] != record.size:
+        raise ValueError(path + " is not a recording of Manestrone")
+    capacity = head[2]
+    written = head[3]
+    records = []
+    for number in range(max(0, written - capacity), written):
+        fields = record.unpack_from(data, header.size + (number % capacity) * record.size)
+        records.append({"time":fields[0], "duration":fields[1], "bmRequestType":fields[2],
+                        "bRequest":fields[3], "wValue":fields[4], "wIndex":fields[5],
+                        "status":fields[7], "data":fields[8][:fields[6]]})
+    return ({"capacity":capacity, "written":written, "startTime":head[4],
+             "serial":head[5].rstrip(b"\0").decode()}, records)
+
+class replayDevice:
+    # answers reads of each register with the values recorded for it, in recorded order
+    # (the last one again, when they run out), and failed transfers fail again the same way.
+    # writes are accepted. with "timing", each transfer takes its recorded duration.
+    # transfers are counted in "stats", as ManestroneSim.quartetSim does.
+
+    def __init__(self, path, HWdata = None, timing = False):
+        if HWdata is None:
+            HWdata = core.Quartet
+        self.HWdata = HWdata
+        self.timing = timing
+        self.info, records = read_recording(path)
+        self.serial_number = self.info["serial"] or "REPLAY"
+        self.requests = {}             # request code -> name in HWdata
+        for name, value in HWdata.items():
+            if name.endswith("_Request"):
+                self.requests[value] = name
+        self.reads = {}                # (request code, wValue, wIndex) -> recorded reads
+        self.writes = {}               # and writes
+        for each in records:
+            key = (each["bRequest"], each["wValue"], each["wIndex"])
+            table = self.reads if each["bmRequestType"] & 0x80 else self.writes
+            table.setdefault(key, []).append(each)
+        self.lock = threading.Lock()
+        self.rewind()
+
+    def rewind(self): # replays from the start again
+        with self.lock:
+            self.position = {}         # (direction, key) -> number of transfers replayed
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"reads":0, "writes":0, "requests":{}, "seconds":0.0, "faults":{},
+                          "misses":0}  # reads of registers not in the recording
+
+    def next_record(self, table, write, key): # recorded transfer to replay, or None
+        recorded = table.get(key)
+        if not recorded:
+            return None
+        with self.lock:
+            position = self.position.get((write, key), 0)
+            self.position[(write, key)] = position + 1
+        return recorded[min(position, len(recorded) - 1)]
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue = 0, wIndex = 0,
+                      data_or_wLength = None, timeout = None):
+        start = time.perf_counter()
+        write = not (bmRequestType & 0x80)
+        key = (bRequest, wValue, wIndex)
+        each = self.next_record(self.writes if write else self.reads, write, key)
+        if each is not None and self.timing:
+            time.sleep(each["duration"])
+        name = self.requests.get(bRequest, str(bRequest))
+        with self.lock:
+            self.stats["writes" if write else "reads"] += 1
+            self.stats["requests"][name] = self.stats["requests"].get(name, 0) + 1
+            self.stats["seconds"] += time.perf_counter() - start
+            if each is not None and each["status"] != statusOK:
+                kind = "timeout" if each["status"] == statusTimeout else "error"
+                self.stats["faults"][kind] = self.stats["faults"].get(kind, 0) + 1
+            if each is None and not write:
+                self.stats["misses"] += 1
+        if each is not None and each["status"] == statusTimeout:
+            raise USBTimeoutError("Operation timed out (recorded)", -7, 110)
+        if each is not None and each["status"] == statusError:
+            raise USBError("Input/Output Error (recorded)", -1, 5)
+        if write:
+            return len(data_or_wLength)
+        if each is None:
+            return bytes(data_or_wLength if isinstance(data_or_wLength, int) else 1)
+        return each["data"]
+
+    def get_active_configuration(self): # no notification endpoint: changes come by polling
+        return [[]]
+
+if __name__ == "__main__":
+    info, records = read_recording(sys.argv[1])
+    print("serial %s, %d transfers recorded, %d kept"
+          % (info["serial"], info["written"], len(records)))
+    requests = {}
+    for name, value in core.Quartet.items():
+        if name.endswith("_Request"):
+            requests[value] = name
+    for each in records:
+        print("%10.6f %7.3f ms %-3s %-24s %5d %5d %-7s %s"
+              % (each["time"], each["duration"] * 1000,
+                 "IN" if each["bmRequestType"] & 0x80 else "OUT",
+                 requests.get(each["bRequest"], str(each["bRequest"])),
+                 each["wValue"], each["wIndex"],
+                 ["ok", "timeout", "error"][each["status"]], each["data"].hex()))
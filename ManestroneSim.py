@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# ManestroneSim.py
+#
+# Copyright (C) 2021  SUZUDO Yasushi  <yasushi_suzudo@yahoo.co.jp>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+
+# stand-in of Apogee Quartet, for use without hardware.
+# it answers control transfers as pyusb device does: every "*_Request" code of the device profile
+# is a register, which keeps the last value written for each (wValue, wIndex) (0 at first).
+# mixerHWset_Request is write-only: its message is kept per wIndex (mixer * 2 + left 0/right 1),
+# see mixer_payload. other codes, and reads of mixerHWset_Request, fail as the device stalls.
+# each transfer takes "latency" seconds, and is counted in "stats".
+# faults of a flaky USB connection are injected on schedule (see inject): timeouts, errors,
+# slow transfers and disappearance of the device.
+# front_panel() changes a register as the knob or buttons of the device would, sending a
+# notification from its interrupt IN endpoint (see ManestroneCore.notifyListener).
+#
+# Manestrone04.py uses it when OFFLINE is True, ManestroneDaemon.py and manestrone with "--sim".
+
+import time
+import array
+import queue
+import random
+import threading
+import ManestroneCore as core
+try:
+    from usb.core import USBError
+except ImportError:  # pyusb is not needed for simulation
+    class USBError(IOError):
+        def __init__(self, strerror, error_code = None, errno = None):
+            IOError.__init__(self, errno, strerror)
+            self.backend_error_code = error_code
+try:
+    from usb.core import USBTimeoutError
+except ImportError:  # also for pyusb older than 1.1
+    class USBTimeoutError(USBError):
+        pass
+
+faultKinds = ["timeout",  # transfer fails after "delay" seconds (default: its timeout)
+              "error",    # transfer fails at once (I/O error)
+              "slow",     # transfer succeeds after "delay" seconds
+              "gone"]     # device disappears: this and every later transfer fails (see reconnect)
+
+class simEndpoint:
+
+    def __init__(self, address, attributes):
+        self.bEndpointAddress = address
+        self.bmAttributes = attributes
+
+class quartetSim:
+
+    def __init__(self, HWdata = None, notify = True, latency = 0.0, seed = 0):
+        if HWdata is None:
+            HWdata = core.Quartet
+        self.HWdata = HWdata
+        self.notify = notify           # if False, the device has no notification endpoint
+        self.latency = latency         # seconds taken by each control transfer
+        self.serial_number = "SIM0001"
+        self.requests = {}             # request code -> name in HWdata
+        for name, value in HWdata.items():
+            if name.endswith("_Request"):
+                self.requests[value] = name
+        self.regs = {}                 # (request code, wValue, wIndex) -> value
+        self.mixerHW = {}              # wIndex -> last message of mixerHWset_Request
+        self.notifications = queue.Queue()
+        self.faults = []               # rules of fault injection (see inject)
+        self.random = random.Random(seed)
+        self.transfers = 0             # sequence number of next transfer, failed ones included
+        self.gone = False              # True after "gone" fault
+        self.lock = threading.Lock()   # for stats and faults
+        self.reset_stats()
+
+    def inject(self, kind, start = 0, every = 1, count = None, probability = None, delay = None):
+        # from transfer number "start", every "every"-th transfer gets fault "kind"
+        # (see faultKinds), at most "count" times, with "probability" (None: always).
+        if kind not in faultKinds:
+            raise ValueError("unknown fault: " + str(kind))
+        with self.lock:
+            self.faults.append({"kind":kind, "start":start, "every":every, "count":count,
+                                "probability":probability, "delay":delay, "fired":0})
+
+    def clear_faults(self):
+        with self.lock:
+            self.faults = []
+
+    def reconnect(self): # device comes back after "gone" fault
+        self.gone = False
+
+    def fault(self): # fault rule for this transfer, or None
+        with self.lock:
+            number = self.transfers
+            self.transfers += 1
+            for rule in self.faults:
+                if (number < rule["start"] or (number - rule["start"]) % rule["every"] != 0
+                    or (rule["count"] is not None and rule["fired"] >= rule["count"])):
+                    continue
+                if rule["probability"] is not None and self.random.random() >= rule["probability"]:
+                    continue
+                rule["fired"] += 1
+                self.stats["faults"][rule["kind"]] = self.stats["faults"].get(rule["kind"], 0) + 1
+                return rule
+        return None
+
+    def no_device(self):
+        return USBError("No such device (it may have been disconnected)", -4, 19) # ENODEV
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"reads":0, "writes":0,
+                          "requests":{},    # name of request -> number of transfers
+                          "seconds":0.0,    # time spent in transfers
+                          "faults":{}}      # kind of fault -> number injected
+
+    def count(self, name, write, start):
+        with self.lock:
+            self.stats["writes" if write else "reads"] += 1
+            self.stats["requests"][name] = self.stats["requests"].get(name, 0) + 1
+            self.stats["seconds"] += time.perf_counter() - start
+
+    def ctrl_transfer(self, bmRequestType, bRequest, wValue = 0, wIndex = 0,
+                      data_or_wLength = None, timeout = None):
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        rule = self.fault()
+        if rule is not None:
+            if rule["kind"] == "gone":
+                self.gone = True
+            elif rule["kind"] == "error":
+                raise USBError("Input/Output Error", -1, 5) # EIO
+            else:
+                delay = rule["delay"]
+                if delay is None:
+                    delay = (timeout if timeout else 1000) / 1000
+                time.sleep(delay)
+                if rule["kind"] == "timeout":
+                    raise USBTimeoutError("Operation timed out", -7, 110) # ETIMEDOUT
+        if self.gone:
+            raise self.no_device()
+        write = not (bmRequestType & 0x80) # else device to host
+        name = self.requests.get(bRequest)
+        if name is None:
+            raise USBError("Pipe error (unknown request %d)" % bRequest)
+        if name == "mixerHWset_Request":
+            if not write:
+                raise USBError("Pipe error (mixerHWset_Request is write-only)")
+            self.mixerHW[wIndex] = bytes(data_or_wLength)
+            result = len(data_or_wLength)
+        elif write:
+            self.regs[(bRequest, wValue, wIndex)] = data_or_wLength[0]
+            result = len(data_or_wLength)
+        else:
+            result = array.array("B", [self.regs.get((bRequest, wValue, wIndex), 0)])
+        self.count(name, write, start)
+        return result
+
+    def get_active_configuration(self): # [interface [endpoint]]
+        if self.notify:
+            return [[simEndpoint(0x81, 0x03)]] # interrupt IN
+        return [[]]
+
+    def read(self, endpoint, size, timeout = None):
+        if self.gone:
+            raise self.no_device()
+        try:
+            return self.notifications.get(timeout = timeout / 1000)
+        except queue.Empty:
+            raise TimeoutError("notification read timed out")
+
+    def value(self, request, wValue = 0, wIndex = 0): # register value, by name of request
+        return self.regs.get((self.HWdata[request], wValue, wIndex), 0)
+
+    def mixer_payload(self, mixerindex): # last message sent to mixer, as mixerEngine.payload
+        return {"left":self.mixerHW.get(mixerindex * 2),
+                "right":self.mixerHW.get(mixerindex * 2 + 1)}
+
+    def front_panel(self, request, wIndex, value, wValue = 0): # as if changed on the device
+        code = self.HWdata[request]
+        self.regs[(code, wValue, wIndex)] = value
+        if self.notify:
+            self.notifications.put(array.array("B", [code, wValue, wIndex, value]))